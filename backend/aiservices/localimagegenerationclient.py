@@ -1,12 +1,47 @@
+from contextlib import nullcontext
 from typing import Optional
 import base64
+import importlib.util
 import io
+import logging
 
 import torch
 from diffusers import AutoPipelineForText2Image
 
 from ..config import Settings, get_settings
 
+logger = logging.getLogger(__name__)
+
+_JPEG_QUALITY = 90
+# Below this much free VRAM after loading, attention is sliced to bound peak memory
+_ATTENTION_SLICING_FREE_VRAM = 3 * 1024 ** 3
+# After a failed generation the allocator cache is only flushed when less than this is free on the device
+_EMPTY_CACHE_HEADROOM = 1024 ** 3
+
+
+def _load_turbojpeg():
+    """Return a libjpeg-turbo JPEG encoder when PyTurboJPEG is installed, otherwise None (Pillow is used)."""
+    try:
+        import numpy as np
+        from turbojpeg import TJPF_RGB, TurboJPEG
+        encoder = TurboJPEG()
+    except (ImportError, OSError):  # package missing or libturbojpeg not found
+        return None
+    return lambda image: encoder.encode(np.asarray(image.convert("RGB")), quality=_JPEG_QUALITY, pixel_format=TJPF_RGB)
+
+
+def _load_cuda_jpeg_encoder():
+    """Return torchvision's nvJPEG encoder when it can encode CUDA tensors, otherwise None."""
+    if not torch.cuda.is_available():
+        return None
+    try:
+        from torchvision.io import encode_jpeg
+        # CUDA inputs need torchvision >= 0.19; probe once instead of parsing versions
+        encode_jpeg(torch.zeros(3, 8, 8, dtype=torch.uint8, device="cuda"), quality=_JPEG_QUALITY)
+    except Exception:
+        return None
+    return encode_jpeg
+
 class LocalImageGenerationClient():
     """Wrapper around a Diffusers Stable Diffusion pipeline."""
 
@@ -15,26 +50,41 @@ class LocalImageGenerationClient():
         if not self.settings.enable_image_generation:
             self._pipeline = None
             self._is_turbo = False
+            self._cpu_bf16 = False
+            self._turbojpeg = None
+            self._cuda_jpeg = None
             return
 
         # Detect if this is a turbo model for optimized generation
         self._is_turbo = "turbo" in self.settings.image_model_id.lower()
+        self._cpu_bf16 = False
+        # SIMD JPEG encoder; several times faster than Pillow's for large images
+        self._turbojpeg = _load_turbojpeg()
+        # On CUDA the image is encoded on the GPU and only the JPEG bytes are copied back
+        self._cuda_jpeg = _load_cuda_jpeg_encoder()
         
         torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
         
         # Load VAE separately with proper fp16 variant to avoid dtype mismatch
         vae = None
-        if torch.cuda.is_available():
-            try:
-                from diffusers import AutoencoderKL
-                # Use the fp16 fix VAE which properly handles mixed precision
-                vae = AutoencoderKL.from_pretrained(
-                    "madebyollin/sdxl-vae-fp16-fix",
-                    torch_dtype=torch_dtype
-                )
-            except Exception as e:
-                print(f"Warning: Could not load fp16-fix VAE: {e}")
-                vae = None
+        if self.settings.image_tiny_vae_id:
+            from diffusers import AutoencoderTiny
+            # Distilled decoder: a fraction of the full VAE's FLOPs for 1-step Turbo images
+            vae = AutoencoderTiny.from_pretrained(
+                self.settings.image_tiny_vae_id,
+                torch_dtype=torch_dtype,
+                use_safetensors=True,
+            )
+        elif torch.cuda.is_available() and self.settings.image_vae_id:
+            from diffusers import AutoencoderKL
+            # The fp16-fix VAE decodes in half precision without the fp32 upcast.
+            # Failures are not swallowed: silently falling back would keep the slow VAE.
+            vae = AutoencoderKL.from_pretrained(
+                self.settings.image_vae_id,
+                torch_dtype=torch_dtype,
+                use_safetensors=True,
+                low_cpu_mem_usage=True,
+            )
         
         # Use AutoPipeline which automatically selects the right pipeline type
         self._pipeline = AutoPipelineForText2Image.from_pretrained(
@@ -43,6 +93,10 @@ class LocalImageGenerationClient():
             safety_checker=None,
             variant="fp16" if torch.cuda.is_available() else None,
             vae=vae,
+            # mmap safetensors shards straight into the target dtype instead of
+            # unpickling a full fp32 copy into host RAM first
+            use_safetensors=True,
+            low_cpu_mem_usage=True,
         )
         
         # SDXL-Turbo requires a specific scheduler for 1-4 step generation
@@ -56,58 +110,126 @@ class LocalImageGenerationClient():
         
         if torch.cuda.is_available():
             self._pipeline.to("cuda")
-            # Enable memory efficient attention to reduce VRAM usage
-            self._pipeline.enable_attention_slicing()
+            self._configure_cuda_attention()
+            if self.settings.image_compiler != "none":
+                self._compile_for_cuda()
         elif torch.backends.mps.is_available():
             self._pipeline.to("mps")
         else:
             self._pipeline.to("cpu")
+            if self.settings.enable_ipex:
+                self._optimize_for_cpu()
 
-    def generate(self, prompt: str) -> str:
-        if not self.settings.enable_image_generation or self._pipeline is None:
-            raise RuntimeError("Image generation is disabled in the current configuration.")
+    def _configure_cuda_attention(self) -> None:
+        """Run attention through fused SDPA (Flash / memory-efficient) kernels.
+
+        Attention slicing splits the op into Python-driven chunks and is only
+        kept as a fallback when the GPU is short on memory.
+        """
+        from diffusers.models.attention_processor import AttnProcessor2_0
+
+        self._pipeline.unet.set_attn_processor(AttnProcessor2_0())
+        free_vram, _ = torch.cuda.mem_get_info()
+        if free_vram < _ATTENTION_SLICING_FREE_VRAM:
+            logger.info("Only %d MiB of VRAM free, enabling attention slicing", free_vram // 2 ** 20)
+            self._pipeline.enable_attention_slicing()
+
+    def _compile_for_cuda(self) -> None:
+        """Compile the pipeline and run one warmup generation to pay the compile cost up front."""
+        if self.settings.image_compiler == "stable-fast":
+            try:
+                from sfast.compilers.diffusion_pipeline_compiler import CompilationConfig, compile
+            except ImportError:
+                logger.warning("STUDYBUDDY_IMAGE_COMPILER=stable-fast but stable-fast is not installed")
+                return
+            config = CompilationConfig.Default()
+            config.enable_cuda_graph = True
+            # xformers/triton kernels are optional accelerations inside stable-fast
+            config.enable_xformers = importlib.util.find_spec("xformers") is not None
+            config.enable_triton = importlib.util.find_spec("triton") is not None
+            self._pipeline = compile(self._pipeline, config)
+        else:
+            self._pipeline.unet = torch.compile(self._pipeline.unet, mode="reduce-overhead", fullgraph=False)
+            self._pipeline.vae.decode = torch.compile(self._pipeline.vae.decode, mode="reduce-overhead")
+        # The warmup uses the same steps/guidance as real requests so the compiled graphs are reused
+        self._run_pipeline("warmup")
 
+    def _optimize_for_cpu(self) -> None:
+        """Swap the UNet/VAE for IPEX bf16 kernels; generation then runs under CPU autocast."""
         try:
-            # Clear CUDA cache before generation to prevent memory corruption
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-                torch.cuda.synchronize()
-            
-            # Generate image with proper parameters based on model type
+            import intel_extension_for_pytorch as ipex
+        except ImportError:
+            logger.warning("STUDYBUDDY_ENABLE_IPEX is set but intel_extension_for_pytorch is not installed")
+            return
+
+        self._pipeline.unet = ipex.optimize(self._pipeline.unet.eval(), dtype=torch.bfloat16, inplace=True)
+        self._pipeline.vae = ipex.optimize(self._pipeline.vae.eval(), dtype=torch.bfloat16, inplace=True)
+        self._cpu_bf16 = True
+
+    def _encode_jpeg(self, image) -> bytes:
+        if self._cuda_jpeg is not None:
+            # image is a float CHW tensor in [0, 1] on the GPU (output_type="pt")
+            pixels = image.mul(255).round_().clamp_(0, 255).to(torch.uint8)
+            return self._cuda_jpeg(pixels, quality=_JPEG_QUALITY).cpu().numpy().tobytes()
+        if self._turbojpeg is not None:
+            return self._turbojpeg(image)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=_JPEG_QUALITY)
+        return buffer.getvalue()
+
+    def _run_pipeline(self, prompt: str):
+        # IPEX-optimized modules expect bf16 activations on CPU
+        autocast = torch.autocast("cpu", dtype=torch.bfloat16) if self._cpu_bf16 else nullcontext()
+
+        # Keep the decoded image on the GPU when it is encoded there
+        output_type = "pt" if self._cuda_jpeg is not None else "pil"
+
+        # Generate image with proper parameters based on model type
+        with autocast:
             if self._is_turbo:
                 # SDXL-Turbo: optimized for speed with 1-4 steps, no guidance
                 # Use 1 step for fastest generation, no guidance scale
-                image = self._pipeline(
+                return self._pipeline(
                     prompt=prompt,
                     num_inference_steps=1,
                     guidance_scale=0.0,
+                    output_type=output_type,
                 ).images[0]
-            else:
-                # Standard models: use more steps and guidance
-                image = self._pipeline(
-                    prompt=prompt,
-                    num_inference_steps=20,
-                    guidance_scale=7.5,
-                ).images[0]
-            
-            # Clear cache after generation
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            
-            buffer = io.BytesIO()
-            image.save(buffer, format="JPEG", quality=90)
-            encoded = base64.b64encode(buffer.getvalue()).decode("utf-8")
-            return encoded
-            
-        except Exception as e:
-            # On CUDA error, try to recover by clearing cache and resetting
+            # Standard models: use more steps and guidance
+            return self._pipeline(
+                prompt=prompt,
+                num_inference_steps=20,
+                guidance_scale=7.5,
+                output_type=output_type,
+            ).images[0]
+
+    def warmup(self) -> None:
+        """Run one throwaway generation so CUDA kernels are loaded before the first request."""
+        if self._pipeline is None:
+            return
+        if torch.cuda.is_available() and self.settings.image_compiler != "none":
+            return  # already warmed up by _compile_for_cuda
+        self._run_pipeline("warmup")
+
+    def generate(self, prompt: str) -> str:
+        """Generate an image and return it as a base64-encoded JPEG."""
+        return base64.b64encode(self.generate_bytes(prompt)).decode("ascii")
+
+    def generate_bytes(self, prompt: str) -> bytes:
+        """Generate an image and return the raw JPEG bytes."""
+        if not self.settings.enable_image_generation or self._pipeline is None:
+            raise RuntimeError("Image generation is disabled in the current configuration.")
+
+        try:
+            image = self._run_pipeline(prompt)
+            return self._encode_jpeg(image)
+
+        except Exception:
+            # Release cached blocks after a failure (e.g. OOM) so the next request can allocate,
+            # but only when the device is actually short on memory. The driver's free count
+            # also covers other processes on the GPU, such as the vLLM engine workers.
             if torch.cuda.is_available():
-                try:
+                free_vram, _ = torch.cuda.mem_get_info()
+                if free_vram < _EMPTY_CACHE_HEADROOM:
                     torch.cuda.empty_cache()
-                    torch.cuda.synchronize()
-                    # Try to reset CUDA context
-                    with torch.cuda.device(0):
-                        torch.cuda.empty_cache()
-                except:
-                    pass
-            raise e
\ No newline at end of file
+            raise
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from typing import Any, Optional
+from typing import Any, Iterator, List, Optional
 
 # Define an abstract interface for text generation clients so different
 # implementations (local, remote, mock) can be used interchangeably.
@@ -25,8 +25,26 @@ class TextGenerationClient(ABC):
         prompt: str,
         max_new_tokens: Optional[int] = None,
         temperature: Optional[float] = None,
+        num_return_sequences: int = 1,
     ) -> Any:  # Concrete implementations should return a GenerationResult-like object
-        """Generate free-form text from a prompt."""
+        """Generate free-form text from a prompt.
+
+        With ``num_return_sequences`` > 1 the prompt is sampled that many times;
+        all completions are returned in ``candidates`` and ``text`` holds the first.
+        """
+
+    def generate_stream(
+        self,
+        prompt: str,
+        max_new_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+    ) -> Iterator[str]:
+        """Generate free-form text from a prompt, yielding it as it is decoded.
+
+        The default implementation yields the complete text of :meth:`generate`
+        in a single chunk; backends that can stream should override it.
+        """
+        yield self.generate(prompt, max_new_tokens=max_new_tokens, temperature=temperature).text
 
     @abstractmethod
     def generate_structured(
@@ -41,6 +59,31 @@ class TextGenerationClient(ABC):
         Should raise RuntimeError if structured output is not supported.
         """
 
+    def generate_structured_batch(
+        self,
+        prompts: List[str],
+        response_model: Any,
+        max_new_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+    ) -> List[Any]:
+        """Generate structured output for several prompts, one result per prompt in order.
+
+        A prompt whose generation or validation fails yields its exception in
+        place of a result, so the other results are still returned.
+
+        The default implementation calls :meth:`generate_structured` for each
+        prompt; backends that batch requests should override it.
+        """
+        results: List[Any] = []
+        for prompt in prompts:
+            try:
+                results.append(
+                    self.generate_structured(prompt, response_model, max_new_tokens=max_new_tokens, temperature=temperature)
+                )
+            except Exception as exc:
+                results.append(exc)
+        return results
+
     @abstractmethod
     def generate_conversational(
         self,
@@ -54,3 +97,24 @@ class TextGenerationClient(ABC):
 
         Should raise RuntimeError if conversational generation is not supported.
         """
+
+    def generate_conversational_stream(
+        self,
+        context: str,
+        conversation_messages: list[dict],
+        user_message: str,
+        max_new_tokens: int | None = None,
+        temperature: float | None = None,
+    ) -> Iterator[str]:
+        """Generate a conversational response, yielding it as it is decoded.
+
+        The default implementation yields the complete text of
+        :meth:`generate_conversational` in a single chunk.
+        """
+        yield self.generate_conversational(
+            context=context,
+            conversation_messages=conversation_messages,
+            user_message=user_message,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+        ).text
@@ -1,50 +1,598 @@
-from typing import Any, Optional
-from dataclasses import dataclass
+import itertools
+import json
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from dataclasses import dataclass, field
 from pydantic import BaseModel
 
+import torch
 from vllm import LLM, SamplingParams
 from vllm.sampling_params import GuidedDecodingParams
 
 from ..config import Settings, get_settings
 from .textgenerationclient import TextGenerationClient
 
+logger = logging.getLogger(__name__)
+
+_ALLOWED_ROLES = frozenset({"user", "assistant"})
+
+# Fixed part of the chat system prompt; the conversation context is appended to it.
+_CHAT_SYSTEM_POLICY = (
+    "You are StudyBuddy — a playful, warm, witty study coach for novices. "
+    "Talk directly to the user in 1–4 sentences; be friendly, concise, and natural. "
+    "Use factual claims ONLY from the Context below. If a fact isn’t there, say you’re not sure and (optionally) give a brief guess. "
+    "When asked about the source, summarize what it SAYS — do not speculate about where it came from or its type unless the Context states it. "
+    "Small talk and curiosity are welcome; answer it briefly. For opinion questions, you don’t have real feelings, "
+    "but you may give a light, mascot-style response (e.g., a playful remark) as long as you don’t present opinions as facts. "
+    "Refocus toward studying only if the user asks for study help OR after two consecutive small-talk turns; "
+    "when you do, keep the nudge gentle and at most once every few turns. "
+    "Avoid quizzes, lists, or multiple options unless requested. English only.\n\n"
+    "Context (authoritative facts):\n"
+)
+
+
 @dataclass
 class GenerationResult:
     text: str
+    # All sampled completions when more than one was requested; text is the first.
+    candidates: List[str] = field(default_factory=list)
+
+
+def _resolve_kv_cache_dtype(configured: Optional[str]) -> str:
+    """Return the KV cache dtype to use, honouring an explicit setting.
+
+    Hopper (compute capability 9.0+) has native FP8 support, so storing the KV
+    cache in FP8 halves its footprint at no extra cost. Older GPUs would have
+    to emulate FP8 in software, so they keep the model dtype instead.
+    """
+    if configured:
+        return configured
+    if torch.cuda.is_available() and torch.cuda.get_device_capability() >= (9, 0):
+        return "fp8_e5m2"
+    return "auto"
+
+
+_STREAM_END = object()
+
+
+class _StreamSink:
+    """Hand the incremental outputs of a streaming request to its consumer."""
+
+    def __init__(self) -> None:
+        self.outputs: "queue.Queue[Any]" = queue.Queue()
+        # Only written by the engine loop, so it can tell a late abort from an early one
+        self.done = False
+
+    def set_partial(self, output: Any) -> None:
+        self.outputs.put(output)
+
+    def set_result(self, output: Any) -> None:
+        self.done = True
+        self.outputs.put(output)
+        self.outputs.put(_STREAM_END)
+
+    def set_exception(self, exc: BaseException) -> None:
+        self.done = True
+        self.outputs.put(exc)
+
+
+class _EngineLoop:
+    """Drive the vLLM engine from one thread with continuous batching.
+
+    FastAPI dispatches every request to its own worker thread, and
+    ``LLM.generate`` blocks until its whole batch is finished, so concurrent
+    callers would otherwise queue behind each other. Instead, callers hand
+    their prompt to this loop, which adds it to the engine between decode
+    steps. New requests join the running batch immediately and finished ones
+    leave it, so every step decodes all in-flight sequences together.
+    """
+
+    def __init__(self, llm: LLM) -> None:
+        self._engine = llm.llm_engine
+        self._queue: "queue.Queue[Tuple[str, Any, SamplingParams, Any]]" = queue.Queue()
+        self._aborted: "queue.Queue[Tuple[str, _StreamSink]]" = queue.Queue()
+        self._request_ids = itertools.count()
+        self._worker = threading.Thread(target=self._run, name="vllm-engine-loop", daemon=True)
+        self._worker.start()
+
+    def _next_request_id(self) -> str:
+        return str(next(self._request_ids))
+
+    def submit(self, prompt: Any, sampling_params: SamplingParams) -> Future:
+        """Queue ``prompt`` and return a future resolving to its final output."""
+        future: Future = Future()
+        future.set_running_or_notify_cancel()  # the loop owns it now, callers cannot cancel it
+        self._queue.put((self._next_request_id(), prompt, sampling_params, future))
+        return future
+
+    def stream(self, prompt: Any, sampling_params: SamplingParams) -> Iterator[Any]:
+        """Queue ``prompt`` and yield its (cumulative) output after every step."""
+        request_id = self._next_request_id()
+        sink = _StreamSink()
+        self._queue.put((request_id, prompt, sampling_params, sink))
+        finished = False
+        try:
+            while True:
+                item = sink.outputs.get()
+                if item is _STREAM_END:
+                    finished = True
+                    return
+                if isinstance(item, BaseException):
+                    finished = True
+                    raise item
+                yield item
+        finally:
+            if not finished:  # the consumer stopped early, free the sequence
+                self._aborted.put((request_id, sink))
+
+    def _admit(self, pending: Dict[str, Any], item: Tuple[str, Any, SamplingParams, Any]) -> None:
+        request_id, prompt, sampling_params, sink = item
+        try:
+            self._engine.add_request(request_id, prompt, sampling_params)
+        except Exception as exc:  # e.g. prompt longer than max_model_len
+            sink.set_exception(exc)
+            return
+        pending[request_id] = sink
+
+    def _run(self) -> None:
+        pending: Dict[str, Any] = {}
+        cancelled: Dict[str, _StreamSink] = {}
+        while True:
+            # Callers wait on their futures and sinks without a timeout, so the
+            # loop must never die: a failed iteration fails the requests in flight.
+            try:
+                self._iterate(pending, cancelled)
+            except Exception as exc:
+                logger.exception("vLLM engine loop iteration failed")
+                self._fail_pending(pending, exc)
+
+    def _fail_pending(self, pending: Dict[str, Any], exc: BaseException) -> None:
+        try:
+            self._engine.abort_request(list(pending))
+        except Exception:
+            logger.exception("Failed to abort %d vLLM requests", len(pending))
+        for sink in pending.values():
+            sink.set_exception(exc)
+        pending.clear()
+
+    def _iterate(self, pending: Dict[str, Any], cancelled: Dict[str, _StreamSink]) -> None:
+        # Only block while idle; otherwise admit whatever arrived since the last step.
+        if not pending:
+            self._admit(pending, self._queue.get())
+        while True:
+            try:
+                self._admit(pending, self._queue.get_nowait())
+            except queue.Empty:
+                break
+        while True:
+            try:
+                request_id, sink = self._aborted.get_nowait()
+            except queue.Empty:
+                break
+            cancelled[request_id] = sink
+        if cancelled:
+            aborted = [request_id for request_id in cancelled if request_id in pending]
+            if aborted:
+                for request_id in aborted:
+                    pending.pop(request_id)
+                    cancelled.pop(request_id)
+                self._engine.abort_request(aborted)
+            # Aborts can overtake their own request; keep those until it arrives,
+            # but drop the ones whose request already finished.
+            for request_id in [request_id for request_id, sink in cancelled.items() if sink.done]:
+                del cancelled[request_id]
+        if not pending:
+            return
+
+        try:
+            outputs = self._engine.step()
+        except Exception as exc:  # propagate to every waiting caller
+            self._fail_pending(pending, exc)
+            return
+
+        for output in outputs:
+            sink = pending.get(output.request_id)
+            if sink is None:
+                continue
+            if output.finished:
+                del pending[output.request_id]
+                sink.set_result(output)
+            elif isinstance(sink, _StreamSink):
+                sink.set_partial(output)
+
+
+class _ChatPromptRenderer:
+    """Render chat prompts from pre-rendered pieces of the model's chat template.
+
+    ``apply_chat_template`` runs the Jinja template over the whole conversation
+    on every turn. The fixed text between messages only depends on the roles,
+    so it is extracted once by rendering a conversation with sentinel contents
+    and then reused by plain string concatenation. The pieces are validated
+    against the real template at startup; templates or conversations they
+    cannot reproduce fall back to ``apply_chat_template``.
+
+    When tokenizing piece by piece gives the same ids as tokenizing the whole
+    prompt, the ids of every piece and message are cached as well, so a new
+    turn only tokenizes the messages that were not seen before.
+
+    One renderer is shared by all request threads, and Hugging Face fast
+    tokenizers can fail with "Already borrowed" when used from several
+    threads at once, so calls into the tokenizer are serialized; cached
+    token ids are served without taking the lock.
+    """
+
+    _SENTINELS = ("\x00system\x00", "\x00user0\x00", "\x00assistant\x00", "\x00user1\x00")
+    _SAMPLE = [
+        {"role": "system", "content": "You are a helpful tutor.\n\nContext:\nCells divide."},
+        {"role": "user", "content": "Hi!"},
+        {"role": "assistant", "content": "Hello, what shall we study?"},
+        {"role": "user", "content": "How do cells divide?"},
+    ]
+    # Longer texts (in practice the document context) go to the small cache
+    _SHORT_TEXT_CHARS = 2048
+
+    def __init__(self, tokenizer: Any, system_prefix: str = "") -> None:
+        self._tok = tokenizer
+        self._tok_lock = threading.Lock()
+        self._pieces = self._extract_pieces()
+        # Message contents and separators recur on every later turn of a chat,
+        # so their token ids are cached and the prompt is assembled from them.
+        # Document contexts are unbounded, so only a few of them are kept.
+        self._encode_short = lru_cache(maxsize=512)(self._encode_uncached)
+        self._encode_long = lru_cache(maxsize=8)(self._encode_uncached)
+        self._tokenizes_by_part = self._pieces is not None and self._check_part_tokenization()
+        # The fixed policy text at the start of every system message is tokenized
+        # once, so switching context only tokenizes the context itself.
+        self._system_prefix = system_prefix if self._check_prefix_tokenization(system_prefix) else ""
+
+    def _encode(self, text: str) -> Tuple[int, ...]:
+        if len(text) <= self._SHORT_TEXT_CHARS:
+            return self._encode_short(text)
+        return self._encode_long(text)
+
+    def _encode_uncached(self, text: str) -> Tuple[int, ...]:
+        with self._tok_lock:
+            return tuple(self._tok.encode(text, add_special_tokens=False))
+
+    def _check_part_tokenization(self) -> bool:
+        """Whether tokenizing the pieces one by one matches tokenizing the joined prompt."""
+        parts = self._split(self._pieces, self._SAMPLE)
+        try:
+            joined = list(self._encode_uncached("".join(parts)))
+            return [token for part in parts for token in self._encode_uncached(part)] == joined
+        except Exception:  # tokenizers without a plain encode() use the string prompt
+            return False
+
+    def _check_prefix_tokenization(self, prefix: str) -> bool:
+        if not prefix or not self._tokenizes_by_part:
+            return False
+        tail = self._SAMPLE[-1]["content"]
+        return self._encode_uncached(prefix) + self._encode_uncached(tail) == self._encode_uncached(prefix + tail)
+
+    def _encode_system(self, content: str) -> Tuple[int, ...]:
+        prefix = self._system_prefix
+        # Only split where the tail starts a new word, as in the startup check.
+        if prefix and content.startswith(prefix) and content[len(prefix):len(prefix) + 1].strip():
+            return self._encode(prefix) + self._encode(content[len(prefix):])
+        return self._encode(content)
+
+    def _apply_template(self, messages: List[Dict[str, str]]) -> str:
+        with self._tok_lock:
+            return self._tok.apply_chat_template(
+                messages,
+                tokenize=False,
+                add_generation_prompt=True,  # appends assistant header; model will end with <|eot_id|>
+            )
+
+    def _extract_pieces(self) -> Optional[Tuple[str, ...]]:
+        roles = ("system", "user", "assistant", "user")
+        try:
+            rendered = self._apply_template(
+                [{"role": role, "content": sentinel} for role, sentinel in zip(roles, self._SENTINELS)]
+            )
+        except Exception:  # templates that reject this layout simply use the slow path
+            return None
+
+        pieces = []
+        for sentinel in self._SENTINELS:
+            head, found, rendered = rendered.partition(sentinel)
+            if not found:
+                return None
+            pieces.append(head)
+        pieces.append(rendered)
+
+        if self._concatenate(tuple(pieces), self._SAMPLE) != self._apply_template(self._SAMPLE):
+            return None
+        return tuple(pieces)
+
+    @classmethod
+    def _concatenate(cls, pieces: Tuple[str, ...], messages: List[Dict[str, str]]) -> Optional[str]:
+        parts = cls._split(pieces, messages)
+        return None if parts is None else "".join(parts)
+
+    @staticmethod
+    def _split(pieces: Tuple[str, ...], messages: List[Dict[str, str]]) -> Optional[List[str]]:
+        """Interleave ``messages`` with the template pieces, or None if they don't fit.
+
+        Supported layouts are a system message followed by alternating
+        user/assistant turns that end with a user turn.
+        """
+        before_system, system_to_user, user_to_assistant, assistant_to_user, after_user = pieces
+        separators = {
+            ("system", "user"): system_to_user,
+            ("user", "assistant"): user_to_assistant,
+            ("assistant", "user"): assistant_to_user,
+        }
+        if not messages or messages[0]["role"] != "system":
+            return None
+
+        parts = [before_system]
+        previous = None
+        for message in messages:
+            content = message["content"]
+            if content != content.strip():  # templates commonly trim contents
+                return None
+            if previous is not None:
+                separator = separators.get((previous, message["role"]))
+                if separator is None:
+                    return None
+                parts.append(separator)
+            parts.append(content)
+            previous = message["role"]
+
+        if previous != "user":
+            return None
+        parts.append(after_user)
+        return parts
+
+    def render(self, messages: List[Dict[str, str]]) -> str:
+        if self._pieces is not None:
+            prompt = self._concatenate(self._pieces, messages)
+            if prompt is not None:
+                return prompt
+        return self._apply_template(messages)
+
+    def render_token_ids(self, messages: List[Dict[str, str]]) -> Optional[List[int]]:
+        """Token ids of the rendered prompt built from cached per-part ids, or None."""
+        if not self._tokenizes_by_part:
+            return None
+        parts = self._split(self._pieces, messages)
+        if parts is None:
+            return None
+        # parts[1] is the system message content (see _split)
+        return list(itertools.chain(
+            self._encode(parts[0]),
+            self._encode_system(parts[1]),
+            itertools.chain.from_iterable(self._encode(part) for part in parts[2:]),
+        ))
+
+
+@lru_cache(maxsize=64)
+def _guided_params_for(response_model: Any) -> GuidedDecodingParams:
+    """Return guided decoding parameters for ``response_model``, built once per class.
+
+    The schema is serialised canonically so vLLM's grammar cache sees the same
+    key on every request and does not recompile the FSM.
+    """
+    schema = json.dumps(response_model.model_json_schema(), sort_keys=True)
+    return GuidedDecodingParams(json=schema)
+
+
+@lru_cache(maxsize=64)
+def _structured_params_for(response_model: Any, max_tokens: int, temperature: float) -> SamplingParams:
+    """Return the sampling parameters of a structured request, built once per combination.
+
+    Callers use a handful of fixed budgets per schema, and the engine copies
+    parameters before attaching per-request state, so one instance is shared.
+    """
+    return SamplingParams(
+        temperature=temperature,
+        max_tokens=max_tokens,
+        guided_decoding=_guided_params_for(response_model),
+        detokenize=False,  # decoded once when finished
+    )
+
+
+@lru_cache(maxsize=64)
+def _free_form_params_for(
+    n: int, temperature: float, max_tokens: int, top_p: float, detokenize: bool
+) -> SamplingParams:
+    """Return shared sampling parameters for free-form generation (see ``_structured_params_for``).
+
+    Only streamed requests need the engine to detokenize after every step;
+    the others are decoded once from their token ids when they finish.
+    """
+    return SamplingParams(
+        n=n,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        top_p=top_p,
+        repetition_penalty=1.1,
+        stop_token_ids=[],  # add if you need custom stops
+        detokenize=detokenize,
+    )
+
+
+@lru_cache(maxsize=64)
+def _conversational_params_for(
+    temperature: float, max_tokens: int, eot_id: int, detokenize: bool
+) -> SamplingParams:
+    """Return shared sampling parameters for chat replies (see ``_free_form_params_for``)."""
+    return SamplingParams(
+        temperature=temperature,
+        max_tokens=max_tokens,
+        top_p=0.9,
+        repetition_penalty=1.08,
+        stop_token_ids=[eot_id],  # stop at end-of-turn
+        detokenize=detokenize,
+    )
+
+
+@dataclass(frozen=True)
+class _EngineConfig:
+    """Hashable snapshot of the settings that shape the vLLM engine."""
+
+    model: str
+    kv_cache_dtype: str
+    calculate_kv_scales: bool
+    max_model_len: int
+    gpu_memory_utilization: float
+    max_num_seqs: int
+    enable_chunked_prefill: bool
+    max_num_batched_tokens: Optional[int]
+    enforce_eager: bool
+    swap_space: float
+    quantization: Optional[str]
+    compilation_level: Optional[int]
+    enable_prefix_caching: bool
+    guided_decoding_backend: Optional[str]
+    speculative_model: Optional[str]
+    num_speculative_tokens: int
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "_EngineConfig":
+        return cls(
+            model=settings.text_model_id,
+            kv_cache_dtype=_resolve_kv_cache_dtype(settings.kv_cache_dtype),
+            calculate_kv_scales=settings.calculate_kv_scales,
+            max_model_len=settings.max_model_len,
+            gpu_memory_utilization=settings.gpu_memory_utilization,
+            max_num_seqs=settings.max_num_seqs,
+            enable_chunked_prefill=settings.enable_chunked_prefill,
+            max_num_batched_tokens=settings.max_num_batched_tokens,
+            enforce_eager=settings.enforce_eager,
+            swap_space=settings.swap_space,
+            quantization=settings.quantization,
+            compilation_level=settings.compilation_level,
+            enable_prefix_caching=settings.enable_prefix_caching,
+            guided_decoding_backend=settings.guided_decoding_backend,
+            speculative_model=settings.speculative_model,
+            num_speculative_tokens=settings.num_speculative_tokens,
+        )
+
+    def speculative_config(self) -> Optional[Dict[str, Any]]:
+        if not self.speculative_model:
+            return None
+        return {"model": self.speculative_model, "num_speculative_tokens": self.num_speculative_tokens}
+
+
+@dataclass(frozen=True)
+class _Engine:
+    llm: LLM
+    tokenizer: Any
+    eot_id: int
+    chat_renderer: _ChatPromptRenderer
+    loop: _EngineLoop
+
+
+@lru_cache(maxsize=1)
+def _load_engine(config: _EngineConfig) -> _Engine:
+    """Load the vLLM engine once per process and reuse it across clients.
+
+    Re-instantiating the client (tests, hot reloads) would otherwise load
+    another multi-GB copy of the weights and start a second engine loop
+    competing for the same GPU.
+    """
+    llm = LLM(
+        model=config.model,
+        dtype="auto",               # pick fp16/bf16 automatically
+        kv_cache_dtype=config.kv_cache_dtype,
+        calculate_kv_scales=config.calculate_kv_scales,  # fp8_e4m3 without checkpoint k/v scales
+        max_model_len=config.max_model_len,
+        gpu_memory_utilization=config.gpu_memory_utilization,
+        max_num_seqs=config.max_num_seqs,  # upper bound on the continuous batch
+        enable_chunked_prefill=config.enable_chunked_prefill,  # overlap long prefills with decodes
+        max_num_batched_tokens=config.max_num_batched_tokens,
+        enforce_eager=config.enforce_eager,  # False keeps CUDA graphs for decode
+        swap_space=config.swap_space,  # host RAM tier for preempted KV blocks
+        quantization=config.quantization,  # None keeps the checkpoint's native weights
+        compilation_config=config.compilation_level,  # torch.compile + fused kernels
+        enable_prefix_caching=config.enable_prefix_caching,  # reuse system/context KV across turns
+        guided_decoding_backend=config.guided_decoding_backend or "auto",  # logits masking for JSON output
+        speculative_config=config.speculative_config(),  # draft model proposes, main model verifies
+    )
+    # Tokenizer and end-of-turn token for the conversational API
+    tokenizer = llm.get_tokenizer()
+    return _Engine(
+        llm=llm,
+        tokenizer=tokenizer,
+        eot_id=tokenizer.convert_tokens_to_ids("<|eot_id|>"),
+        chat_renderer=_ChatPromptRenderer(tokenizer, system_prefix=_CHAT_SYSTEM_POLICY),
+        # Concurrent requests are batched step by step instead of running one by one.
+        loop=_EngineLoop(llm),
+    )
+
 
 class VLLMTextGenerationClient(TextGenerationClient):
+    # Kept as one constant so every chat turn starts with a byte-identical
+    # prefix, which is what lets the engine reuse its prefix cache.
+    _SYSTEM_TEMPLATE = _CHAT_SYSTEM_POLICY + "{context}"
+
     def __init__(self, settings: Optional[Settings] = None) -> None:
         self.settings = settings or get_settings()
         # vLLM loads the model once and manages KV cache etc. internally.
-        self._llm = LLM(
-            model=self.settings.text_model_id,
-            dtype="auto",               # pick fp16/bf16 automatically
-            kv_cache_dtype="fp8",     # use fp8 for KV cache to save memory
-            max_model_len= 8192,      # adjust based on model capabilities (TODO: make configurable)
-        )
-        # Initialize tokenizer and end-of-turn token for conversational API
-        self._tok = self._llm.get_tokenizer()
-        self._eot_id = self._tok.convert_tokens_to_ids("<|eot_id|>")
+        engine = _load_engine(_EngineConfig.from_settings(self.settings))
+        self._llm = engine.llm
+        self._tok = engine.tokenizer
+        self._eot_id = engine.eot_id
+        self._chat_renderer = engine.chat_renderer
+        self._loop = engine.loop
+        # Plain copies of the per-request defaults, read on every call
+        self._default_temperature = float(self.settings.temperature)
+        self._default_max_new_tokens = int(self.settings.max_new_tokens)
 
     @property
     def supports_structured_output(self) -> bool:
         return True
 
+    def _generate_one(self, prompt: Any, sp: SamplingParams):
+        """Queue a single prompt on the shared engine loop and wait for its output."""
+        return self._loop.submit(prompt, sp).result()
+
+    def _free_form_params(
+        self, max_new_tokens: int | None, temperature: float | None, n: int = 1, stream: bool = False
+    ) -> SamplingParams:
+        return _free_form_params_for(
+            n,
+            temperature if temperature is not None else self._default_temperature,
+            max_new_tokens if max_new_tokens is not None else self._default_max_new_tokens,
+            0.9 if (temperature or self._default_temperature) > 0 else 1.0,
+            stream,
+        )
+
+    def _decode(self, completion: Any) -> str:
+        """Text of a completion generated with ``detokenize=False``."""
+        return self._tok.decode(completion.token_ids, skip_special_tokens=True)
+
     def generate(
         self,
         prompt: str,
         max_new_tokens: int | None = None,
         temperature: float | None = None,
+        num_return_sequences: int = 1,
     ) -> GenerationResult:
-        sp = SamplingParams(
-            temperature=temperature if temperature is not None else self.settings.temperature,
-            max_tokens=max_new_tokens if max_new_tokens is not None else self.settings.max_new_tokens,
-            top_p=0.9 if (temperature or self.settings.temperature) > 0 else 1.0,
-            repetition_penalty=1.1,
-            stop_token_ids=[],  # add if you need custom stops
-        )
-        out = self._llm.generate([prompt], sp)[0].outputs[0].text.strip()
-        return GenerationResult(text=out)
+        # n > 1 samples every candidate from a single shared prefill
+        sp = self._free_form_params(max_new_tokens, temperature, n=num_return_sequences)
+        candidates = [self._decode(o).strip() for o in self._generate_one(prompt, sp).outputs]
+        return GenerationResult(text=candidates[0], candidates=candidates)
+
+    def generate_stream(
+        self,
+        prompt: str,
+        max_new_tokens: int | None = None,
+        temperature: float | None = None,
+    ) -> Iterator[str]:
+        sp = self._free_form_params(max_new_tokens, temperature, stream=True)
+        emitted = 0
+        for output in self._loop.stream(prompt, sp):
+            text = output.outputs[0].text
+            if len(text) > emitted:
+                yield text[emitted:]
+                emitted = len(text)
 
     def generate_structured(
         self,
@@ -53,66 +601,105 @@ class VLLMTextGenerationClient(TextGenerationClient):
         max_new_tokens: int | None = None,
         temperature: float | None = None,
     ):
-        schema = response_model.model_json_schema()
-        sp = SamplingParams(
-            temperature=0.0 if temperature is None else temperature,
-            max_tokens=max_new_tokens if max_new_tokens is not None else self.settings.max_new_tokens,
-            guided_decoding=GuidedDecodingParams(
-                json=schema
-            ),
-        )
-        msg = f"Return ONLY valid JSON for this schema.\n\n{prompt}"
-        out = self._llm.generate([msg], sp)[0].outputs[0].text
-        # vLLM enforces the schema during decoding; still validate defensively:
-        return response_model.model_validate_json(out)
+        result = self.generate_structured_batch([prompt], response_model, max_new_tokens, temperature)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def generate_structured_batch(
+        self,
+        prompts: List[str],
+        response_model: Any,
+        max_new_tokens: int | None = None,
+        temperature: float | None = None,
+    ) -> List[Any]:
+        if max_new_tokens is None:
+            max_new_tokens = self._default_max_new_tokens
+        # One SamplingParams (and guided-decoding grammar) shared by the whole batch
+        sp = _structured_params_for(response_model, max_new_tokens, 0.0 if temperature is None else temperature)
+        # Queue everything before waiting so the engine decodes the prompts together
+        futures = [self._loop.submit(f"Return ONLY valid JSON for this schema.\n\n{prompt}", sp) for prompt in prompts]
+        return [self._structured_result(future, response_model) for future in futures]
+
+    def _structured_result(self, future: Future, response_model: Any) -> Any:
+        # Each output is checked on its own so one bad completion does not discard the batch
+        try:
+            # vLLM enforces the schema during decoding; still validate defensively:
+            return response_model.model_validate_json(self._decode(future.result().outputs[0]))
+        except Exception as exc:
+            return exc
     
-    def generate_conversational(
+    def _conversational_request(
         self,
         context: str,
-        conversation_messages: list[dict],  # [{"role":"user"/"assistant","content":"..."}]
+        conversation_messages: list[dict],
         user_message: str,
-        max_new_tokens: int | None = None,
-        temperature: float | None = None,
-    ) -> GenerationResult:
+        max_new_tokens: int | None,
+        temperature: float | None,
+        stream: bool = False,
+    ) -> Tuple[Any, SamplingParams]:
         # Put policy + authoritative context into SYSTEM so it outranks user text.
-        system = (
-            "You are StudyBuddy — a playful, warm, witty study coach for novices. "
-            "Talk directly to the user in 1–4 sentences; be friendly, concise, and natural. "
-            "Use factual claims ONLY from the Context below. If a fact isn’t there, say you’re not sure and (optionally) give a brief guess. "
-            "When asked about the source, summarize what it SAYS — do not speculate about where it came from or its type unless the Context states it. "
-            "Small talk and curiosity are welcome; answer it briefly. For opinion questions, you don’t have real feelings, "
-            "but you may give a light, mascot-style response (e.g., a playful remark) as long as you don’t present opinions as facts. "
-            "Refocus toward studying only if the user asks for study help OR after two consecutive small-talk turns; "
-            "when you do, keep the nudge gentle and at most once every few turns. "
-            "Avoid quizzes, lists, or multiple options unless requested. English only.\n\n"
-            f"Context (authoritative facts):\n{context or ''}"
-        )
-
+        # Chat templates trim message contents, and untrimmed ones would miss the
+        # pre-rendered fast path (documents usually end with a newline).
+        system = self._SYSTEM_TEMPLATE.format(context=(context or "").strip()).strip()
 
         messages = [{"role": "system", "content": system}]
-        # include the last few turns if you have them
-        for m in (conversation_messages or []):
-            # ensure only "user" / "assistant" roles go here
-            if m.get("role") in {"user", "assistant"} and "content" in m:
-                messages.append({"role": m["role"], "content": m["content"]})
+        # The caller already bounds the history (MAX_CHAT_HISTORY_MESSAGES in main.py);
+        # only "user" / "assistant" roles go here
+        history = [
+            {"role": m["role"], "content": m["content"]}
+            for m in (conversation_messages or [])
+            if m.get("role") in _ALLOWED_ROLES and "content" in m
+        ]
+        messages.extend(history)
         messages.append({"role": "user", "content": user_message})
 
-        # Use the model’s native chat template
-        prompt = self._tok.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True,  # appends assistant header; model will end with <|eot_id|>
-        )
+        # Use the model’s native chat template (cached token ids or pre-rendered pieces when possible)
+        prompt_ids = self._chat_renderer.render_token_ids(messages)
+        if prompt_ids is not None:
+            prompt = {"prompt_token_ids": prompt_ids}  # vllm.inputs.TokensPrompt
+        else:
+            prompt = self._chat_renderer.render(messages)
 
-        sp = SamplingParams(
-            temperature=0.25 if temperature is None else temperature,  # calmer
-            max_tokens=120 if max_new_tokens is None else max_new_tokens,
-            top_p=0.9,
-            repetition_penalty=1.08,
-            stop_token_ids=[self._eot_id],  # stop at end-of-turn
+        sp = _conversational_params_for(
+            0.25 if temperature is None else temperature,  # calmer
+            120 if max_new_tokens is None else max_new_tokens,
+            self._eot_id,
+            stream,
         )
+        return prompt, sp
 
-        out = self._llm.generate([prompt], sp)[0].outputs[0].text
+    def generate_conversational(
+        self,
+        context: str,
+        conversation_messages: list[dict],  # [{"role":"user"/"assistant","content":"..."}]
+        user_message: str,
+        max_new_tokens: int | None = None,
+        temperature: float | None = None,
+    ) -> GenerationResult:
+        prompt, sp = self._conversational_request(
+            context, conversation_messages, user_message, max_new_tokens, temperature
+        )
+        out = self._decode(self._generate_one(prompt, sp).outputs[0])
         # vLLM returns only the completion after the assistant header, but be safe:
         cleaned = out.split("<|eot_id|>")[0].strip()
         return GenerationResult(text=cleaned)
+
+    def generate_conversational_stream(
+        self,
+        context: str,
+        conversation_messages: list[dict],
+        user_message: str,
+        max_new_tokens: int | None = None,
+        temperature: float | None = None,
+    ) -> Iterator[str]:
+        prompt, sp = self._conversational_request(
+            context, conversation_messages, user_message, max_new_tokens, temperature, stream=True
+        )
+        emitted = 0
+        for output in self._loop.stream(prompt, sp):
+            # The end-of-turn token is a stop token, so it never shows up in the text.
+            text = output.outputs[0].text.lstrip()
+            if len(text) > emitted:
+                yield text[emitted:]
+                emitted = len(text)
@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import Literal, Optional
 from pydantic import Field, SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -50,6 +51,14 @@ class Settings(BaseSettings):
         default="stabilityai/sdxl-turbo",
         description="Diffusers checkpoint id used for image generation.",
     )
+    image_vae_id: Optional[str] = Field(
+        default="madebyollin/sdxl-vae-fp16-fix",
+        description="Hub id or local path of the fp16-safe VAE loaded on CUDA. Unset keeps the checkpoint's own VAE.",
+    )
+    image_tiny_vae_id: Optional[str] = Field(
+        default=None,
+        description="Hub id or local path of a tiny autoencoder (e.g. 'madebyollin/taesdxl') that replaces the full VAE for much faster, slightly lower-quality decoding. Unset keeps the full VAE.",
+    )
 
     #----------------------------------------------------------
     # Generation settings
@@ -69,6 +78,91 @@ class Settings(BaseSettings):
         description="Disable to skip image creation while still returning a textual summary.",
     )
 
+    #----------------------------------------------------------
+    # Inference engine settings
+    #----------------------------------------------------------
+    kv_cache_dtype: Optional[str] = Field(
+        default=None,
+        description="KV cache dtype for the text engine (e.g. 'auto', 'fp8_e5m2'). Unset picks FP8 on Hopper GPUs and the model dtype otherwise.",
+    )
+    calculate_kv_scales: bool = Field(
+        default=False,
+        description="Compute FP8 KV cache scales from the first batch when the checkpoint ships none (use with kv_cache_dtype='fp8_e4m3').",
+    )
+    max_model_len: int = Field(
+        default=8192,
+        gt=0,
+        description="Maximum prompt + completion length (in tokens) the text engine reserves KV cache for.",
+    )
+    gpu_memory_utilization: float = Field(
+        default=0.85,
+        gt=0.0,
+        le=1.0,
+        description="Fraction of GPU memory the text engine may use for weights and KV cache.",
+    )
+    max_num_seqs: int = Field(
+        default=256,
+        gt=0,
+        description="Maximum number of sequences the text engine batches together in one decode step.",
+    )
+    enable_chunked_prefill: bool = Field(
+        default=True,
+        description="Split long prompts into chunks that are scheduled alongside ongoing decodes.",
+    )
+    max_num_batched_tokens: Optional[int] = Field(
+        default=2048,
+        gt=0,
+        description="Token budget per engine step; bounds the prefill chunk size when chunked prefill is enabled.",
+    )
+    enforce_eager: bool = Field(
+        default=False,
+        description="Disable CUDA graph capture in the text engine (slower decode, faster startup, less memory).",
+    )
+    swap_space: float = Field(
+        default=8,
+        ge=0,
+        description="Pinned host memory (GiB) the text engine may swap preempted KV blocks into instead of recomputing them.",
+    )
+    quantization: Optional[str] = Field(
+        default=None,
+        description="Weight quantization used by the text engine (e.g. 'awq', 'gptq'). Requires a matching pre-quantized checkpoint.",
+    )
+    compilation_level: Optional[int] = Field(
+        default=None,
+        ge=0,
+        le=3,
+        description="torch.compile level used by the text engine (0 runs eagerly, 3 compiles the full graph). Unset keeps the engine default.",
+    )
+    enable_prefix_caching: bool = Field(
+        default=True,
+        description="Reuse the KV cache of shared prompt prefixes (system prompt + context) across requests.",
+    )
+    guided_decoding_backend: Optional[str] = Field(
+        default=None,
+        description="Grammar backend that constrains structured output to the JSON schema (e.g. 'xgrammar', 'outlines', 'lm-format-enforcer'). Unset keeps the engine default.",
+    )
+    speculative_model: Optional[str] = Field(
+        default=None,
+        description="Draft model id for speculative decoding. Must share the text model's tokenizer (e.g. 'meta-llama/Llama-3.2-1B-Instruct'). Unset disables speculation.",
+    )
+    num_speculative_tokens: int = Field(
+        default=5,
+        gt=0,
+        description="Number of draft tokens proposed per step when speculative decoding is enabled.",
+    )
+    image_compiler: Literal["none", "torch", "stable-fast"] = Field(
+        default="none",
+        description="Compiler applied to the image pipeline on CUDA ('torch' = torch.compile, 'stable-fast' = sfast); the pipeline is warmed up at startup.",
+    )
+    enable_ipex: bool = Field(
+        default=False,
+        description="Optimize the image pipeline with intel_extension_for_pytorch (bf16) when running on CPU.",
+    )
+    warmup: bool = Field(
+        default=False,
+        description="Load the models and run one throwaway generation at startup so the first request does not pay the load/compile cost.",
+    )
+
     # ✅ Pydantic v2 replacement for class Config
     model_config = SettingsConfigDict(
         env_prefix="STUDYBUDDY_",
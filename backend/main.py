@@ -4,14 +4,21 @@ from __future__ import annotations
 
 import os
 os.environ.setdefault("VLLM_WORKER_MULTIPROC_METHOD", "spawn")
+# Let the CUDA caching allocator grow segments instead of fragmenting; must be set before torch initialises CUDA
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
 
+import asyncio
+import hashlib
+import json
 import logging
 import re
-from textwrap import dedent
-from typing import Any, List, Sequence
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
 
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, HTTPException, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from starlette.concurrency import run_in_threadpool
 
 from .config import get_settings
@@ -26,7 +33,6 @@ from .schemas import (
     CreateProjectRequest,
     CreateProjectResponse,
     DeleteResponse,
-    DocumentItem,
     DocumentListResponse,
     EnsureUserRequest,
     EnsureUserResponse,
@@ -35,7 +41,6 @@ from .schemas import (
     GenerateResponse,
     ImageRequest,
     ImageResponse,
-    ProjectListItem,
     ProjectListResponse,
     ProjectRequest,
     SummaryResponse,
@@ -47,9 +52,14 @@ from .storageservice.storageservice import StorageService, get_database_service
 logger = logging.getLogger(__name__)
 
 
+_OPTION_PREFIX_RE = re.compile(r"^[a-d][).:\-\s]+", re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+_LETTER_RE = re.compile(r"^([A-D])\b")
+
+
 def _normalise_option_text(text: str) -> str:
-    cleaned = re.sub(r"^[a-d][).:\-\s]+", "", text.strip(), flags=re.IGNORECASE)
-    cleaned = re.sub(r"\s+", " ", cleaned).strip().lower()
+    cleaned = _OPTION_PREFIX_RE.sub("", text.strip())
+    cleaned = _WHITESPACE_RE.sub(" ", cleaned).strip().lower()
     return cleaned.rstrip('.')
 
 
@@ -66,17 +76,18 @@ def _resolve_answer_letter(correct_answer: str, options: Sequence[str]) -> str:
     if upper_answer in letters:
         return upper_answer
 
-    letter_match = re.match(r"^([A-D])\b", upper_answer)
+    letter_match = _LETTER_RE.match(upper_answer)
     if letter_match:
         return letter_match.group(1)
 
     normalised_answer = _normalise_option_text(answer)
-    for idx, option in enumerate(options[:4]):
-        if _normalise_option_text(option) == normalised_answer:
+    normalised_options = [_normalise_option_text(option) for option in options[:4]]
+    for idx, option in enumerate(normalised_options):
+        if option == normalised_answer:
             return letters[idx]
 
-    for idx, option in enumerate(options[:4]):
-        if normalised_answer and normalised_answer in _normalise_option_text(option):
+    for idx, option in enumerate(normalised_options):
+        if normalised_answer and normalised_answer in option:
             return letters[idx]
 
     raise ValueError(f"could not map answer '{correct_answer}' to one of the options")
@@ -84,7 +95,6 @@ def _resolve_answer_letter(correct_answer: str, options: Sequence[str]) -> str:
 
 MAX_CHAT_HISTORY_MESSAGES = 20
 MAX_CHAT_HISTORY_CHARS = 5000
-MAX_DOCUMENT_CONTEXT_CHARS = 12000
 _TRUNCATION_SUFFIX = "\n[... truncated for length ...]"
 _HISTORY_PREFIX = "[...] "
 
@@ -103,9 +113,12 @@ def _truncate_text(text: str, limit: int) -> tuple[str, bool]:
     return text[: limit - len(suffix)] + suffix, True
 
 
-def _row_to_chat_message(row: Any) -> ChatMessage:
-    role = _ROLE_DB_TO_API.get(row["role"], "model")
-    return ChatMessage(role=role, parts=[ChatPart(text=row["content"])])
+def _rows_to_chat_messages(rows: Sequence[Any]) -> List[ChatMessage]:
+    role_for = _ROLE_DB_TO_API.get
+    return [
+        ChatMessage(role=role_for(row["role"], "model"), parts=[ChatPart(text=row["content"])])
+        for row in rows
+    ]
 
 
 def _compress_chat_history(history: Sequence[ChatMessage]) -> List[ChatMessage]:
@@ -117,8 +130,13 @@ def _compress_chat_history(history: Sequence[ChatMessage]) -> List[ChatMessage]:
     used_chars = 0
 
     for message in reversed(limited_history):  # prioritise the most recent entries
-        message_text = " ".join(part.text for part in message.parts).strip()
-        if not message_text:
+        parts = message.parts
+        if len(parts) == 1:
+            message_text = parts[0].text.strip()
+        else:
+            message_text = " ".join(part.text for part in parts).strip()
+        message_len = len(message_text)
+        if not message_len:
             selected.append(message)
             continue
 
@@ -126,15 +144,15 @@ def _compress_chat_history(history: Sequence[ChatMessage]) -> List[ChatMessage]:
         if available <= 0:
             break
 
-        if len(message_text) > available:
+        if message_len > available:
             truncated_text, _ = _truncate_text(message_text[-available:], available)
-            truncated_text = (_HISTORY_PREFIX + truncated_text) if len(truncated_text) < len(message_text) else truncated_text
+            truncated_text = (_HISTORY_PREFIX + truncated_text) if len(truncated_text) < message_len else truncated_text
             selected.append(ChatMessage(role=message.role, parts=[ChatPart(text=truncated_text)]))
             used_chars = MAX_CHAT_HISTORY_CHARS
             break
 
         selected.append(message)
-        used_chars += len(message_text)
+        used_chars += message_len
 
     selected.reverse()
     if len(selected) < len(history):
@@ -142,40 +160,23 @@ def _compress_chat_history(history: Sequence[ChatMessage]) -> List[ChatMessage]:
     return selected
 
 
-def _build_system_instruction(project_name: str, documents: Sequence[Any]) -> str:
-    print("Building system instruction with documents:", documents)
-    rendered_sections: List[str] = []
-    remaining = MAX_DOCUMENT_CONTEXT_CHARS
-    for doc in documents:
-        content = doc["content"]
-        print("Document content:", content)
-        if not content:
-            continue
-        header = ""
-        footer = ""
-        overhead = len(header) + len(footer)
-        if remaining <= overhead:
-            break
-
-        available_for_content = remaining - overhead
-        snippet, truncated = _truncate_text(content.strip(), available_for_content)
-        section = header + snippet + footer
-        rendered_sections.append(section)
-        remaining -= len(section) + 2  # account for the separator newlines
-        if truncated and remaining <= 0:
-            break
-
-    rendered_documents = "\n\n".join(rendered_sections).strip()
-    if not rendered_documents:
-        rendered_documents = "[No document content available]"
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if get_settings().warmup:
+        logger.info("Warming up generation models")
+        # Building the service loads the models, so it stays off the event loop as well
+        service = await run_in_threadpool(get_studybuddy_service)
+        await run_in_threadpool(service.warmup)
+    yield
 
-    return dedent(
-        f"""
-        {rendered_documents}
-        """
-    ).strip()
 
-app = FastAPI(title="StudyBuddy Backend", version="1.0.0")
+# orjson serialises the large list responses (documents, flashcards, chat) in C
+app = FastAPI(
+    title="StudyBuddy Backend",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -186,8 +187,9 @@ app.add_middleware(
 )
 
 
-@app.get("/health", summary="Health Check Endpoint")
-async def healthcheck():
+@lru_cache(maxsize=1)
+def _health_payload() -> dict:
+    # Settings are fixed for the life of the process, so the payload is built once
     settings = get_settings()
     return {
         "status": "ok",
@@ -196,6 +198,11 @@ async def healthcheck():
     }
 
 
+@app.get("/health", summary="Health Check Endpoint")
+async def healthcheck():
+    return _health_payload()
+
+
 @app.post(
     "/ensure_user",
     response_model=EnsureUserResponse,
@@ -218,22 +225,22 @@ async def list_projects(
     user_id: int,
     service: StorageService = Depends(get_database_service),
 ):
-    rows = await run_in_threadpool(service.list_projects, user_id)
-    projects: List[ProjectListItem] = []
-    for row in rows:
-        document_ids = await run_in_threadpool(service.list_documents, row["id"])
-        projects.append(
-            ProjectListItem(
-                id=row["id"],
-                name=row["name"],
-                summary=row["summary"],
-                document_count=len(document_ids),
-                created_at=row["created_at"],
-                updated_at=row["updated_at"],
-            )
-        )
-
-    return ProjectListResponse(projects=projects)
+    rows = await run_in_threadpool(service.list_projects_with_counts, user_id)
+    # Plain dicts are validated once against the response model, instead of
+    # constructing every item here and having FastAPI validate it again.
+    projects = [
+        {
+            "id": row["id"],
+            "name": row["name"],
+            "summary": row["summary"],
+            "document_count": row["document_count"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+        for row in rows
+    ]
+
+    return {"projects": projects}
 
 
 @app.delete(
@@ -264,19 +271,19 @@ async def list_documents(
     else:
         rows = await run_in_threadpool(service.list_documents_with_metadata, project_id)
 
-    documents: List[DocumentItem] = []
-    for row in rows:
-        documents.append(
-            DocumentItem(
-                id=row["id"],
-                title=row["title"],
-                created_at=row["created_at"],
-                updated_at=row["updated_at"],
-                content=row["content"] if include_content else None,
-            )
-        )
+    # Validated once against the response model (see list_projects)
+    documents = [
+        {
+            "id": row["id"],
+            "title": row["title"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "content": row["content"] if include_content else None,
+        }
+        for row in rows
+    ]
 
-    return DocumentListResponse(documents=documents)
+    return {"documents": documents}
 
 
 @app.delete(
@@ -299,39 +306,67 @@ async def generate_content(
     studybuddy_service: StudyBuddyService = Depends(get_studybuddy_service),
     storage_service: StorageService = Depends(get_database_service),
 ):
-    # Get all documents for the project
-    document_ids = await run_in_threadpool(storage_service.list_documents, payload.project_id)
-    
-    if not document_ids:
+    # Get all documents for the project, with their content, in one query
+    documents = await run_in_threadpool(storage_service.list_documents_with_content, payload.project_id)
+
+    if not documents:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"No documents found for project {payload.project_id}"
         )
 
+    combined_content = "\n\n---\n\n".join(f"# {doc['title']}\n\n{doc['content']}" for doc in documents)
+
+    # Skip the whole generation when neither the documents nor the generation
+    # setup (model, prompts, schemas) changed since the last complete run
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(studybuddy_service.generation_fingerprint().encode("ascii"))
+    hasher.update(combined_content.encode("utf-8"))
+    content_hash = hasher.hexdigest()
+    stored_hash = await run_in_threadpool(storage_service.get_project_content_hash, payload.project_id)
+    if stored_hash == content_hash:
+        return GenerateResponse(status="cached")
+
+    # Invalidate first so a failed run is never mistaken for a complete one
+    await run_in_threadpool(storage_service.update_project_content_hash, payload.project_id, None)
     await run_in_threadpool(storage_service.clear_flashcards_for_project, payload.project_id)
     await run_in_threadpool(storage_service.clear_exam_questions_for_project, payload.project_id)
-    
-    # Generate content for each document individually
-    for doc_id in document_ids:
-        doc = await run_in_threadpool(storage_service.get_document, doc_id)
-        if not doc:
-            continue
-        
-        doc_content = f"Document Title: {doc['title']}\n\n{doc['content']}"
-        
-        # Generate flashcards for this document
-        flashcards = await run_in_threadpool(studybuddy_service.generate_flashcards, doc_content)
-        for flashcard in flashcards:
-            await run_in_threadpool(
-                storage_service.add_flashcard,
-                doc_id,
-                flashcard.question,
-                flashcard.answer
-            )
-        
-        # Generate exam questions for this document
-        exam_questions = await run_in_threadpool(studybuddy_service.generate_practice_exam, doc_content)
-        for question in exam_questions:
+
+    # Flashcards and exam questions for every document are submitted as two batches
+    # so the engine decodes them together, alongside the summary of all documents
+    # combined. Exceptions are gathered as results, so every request is awaited and
+    # the results of one branch are saved even when another fails. Projects whose
+    # documents are all empty get no summary request.
+    doc_contents = [f"Document Title: {doc['title']}\n\n{doc['content']}" for doc in documents]
+    generations = [
+        run_in_threadpool(studybuddy_service.generate_flashcards_batch, doc_contents),
+        run_in_threadpool(studybuddy_service.generate_practice_exam_batch, doc_contents),
+    ]
+    if any(doc["content"] for doc in documents):
+        generations.append(run_in_threadpool(studybuddy_service.generate_summary_with_images, combined_content))
+    flashcards_per_doc, exam_questions_per_doc, *summaries = await asyncio.gather(
+        *generations, return_exceptions=True
+    )
+
+    # A batch that failed as a whole counts as failed for every document
+    if isinstance(flashcards_per_doc, Exception):
+        logger.error("Flashcard generation failed for project %s: %s", payload.project_id, flashcards_per_doc)
+        flashcards_per_doc = [None] * len(documents)
+    if isinstance(exam_questions_per_doc, Exception):
+        logger.error("Exam generation failed for project %s: %s", payload.project_id, exam_questions_per_doc)
+        exam_questions_per_doc = [None] * len(documents)
+
+    flashcard_rows = []
+    exam_question_rows = []
+    failed_documents = 0
+    for doc, flashcards, exam_questions in zip(documents, flashcards_per_doc, exam_questions_per_doc):
+        doc_id = doc["id"]
+        # None marks a document whose generation failed; its other results are still kept
+        if flashcards is None or exam_questions is None:
+            failed_documents += 1
+        flashcard_rows.extend((doc_id, flashcard.question, flashcard.answer) for flashcard in flashcards or ())
+
+        for question in exam_questions or ():
             if len(question.options) < 4:
                 logger.warning(
                     "Skipping exam question with insufficient options for document %s", doc_id
@@ -344,28 +379,33 @@ async def generate_content(
                 logger.warning("Skipping exam question for document %s: %s", doc_id, exc)
                 continue
 
-            await run_in_threadpool(
-                storage_service.add_exam_question,
-                doc_id,
-                question.question,
-                question.options[0],
-                question.options[1],
-                question.options[2],
-                question.options[3],
-                answer_letter,
+            exam_question_rows.append((doc_id, question.question, *question.options[:4], answer_letter))
+
+    # One transaction per table instead of a commit per generated row
+    await run_in_threadpool(storage_service.bulk_add_flashcards, flashcard_rows)
+    await run_in_threadpool(storage_service.bulk_add_exam_questions, exam_question_rows)
+
+    # Each branch is saved on its own: a failed summary leaves the stored one in
+    # place and only marks the run as partial. Without any content there is
+    # nothing to summarise, and a summary of the previous documents must not be
+    # cached as current.
+    summary = summaries[0] if summaries else ""
+    summary_failed = isinstance(summary, Exception)
+    if summary_failed:
+        logger.error("Summary generation failed for project %s: %s", payload.project_id, summary)
+    else:
+        await run_in_threadpool(storage_service.update_project_summary, payload.project_id, summary)
+
+    # Only a complete run is cached; otherwise the next request generates again
+    if failed_documents or summary_failed:
+        if failed_documents:
+            logger.warning(
+                "Generation failed for %d of %d documents in project %s",
+                failed_documents, len(documents), payload.project_id,
             )
-    
-    # Generate summary with images from all documents combined
-    all_content = []
-    for doc_id in document_ids:
-        doc = await run_in_threadpool(storage_service.get_document, doc_id)
-        if doc:
-            all_content.append(f"# {doc['title']}\n\n{doc['content']}")
-    
-    combined_content = "\n\n---\n\n".join(all_content)
-    summary = await run_in_threadpool(studybuddy_service.generate_summary_with_images, combined_content)
-    await run_in_threadpool(storage_service.update_project_summary, payload.project_id, summary)
-    
+        return GenerateResponse(status="partial")
+    await run_in_threadpool(storage_service.update_project_content_hash, payload.project_id, content_hash)
+
     return GenerateResponse(status="success")
 
 
@@ -376,14 +416,9 @@ async def flashcards(
     payload: ProjectRequest,
     service: StorageService = Depends(get_database_service),
 ):
-    document_ids = await run_in_threadpool(service.list_documents, payload.project_id)
-
-    flashcards = []
-    for doc_id in document_ids:
-        doc_flashcards = await run_in_threadpool(service.list_flashcards, doc_id)
-        flashcards.extend(doc_flashcards)
-    
-    return FlashcardResponse(flashcards)
+    flashcards = await run_in_threadpool(service.list_flashcards_for_project, payload.project_id)
+    # Storage already returns validated models, so the list is not re-validated
+    return FlashcardResponse.model_construct(flashcards)
 
 
 @app.post("/practice-exam",
@@ -393,14 +428,8 @@ async def practice_exam(
     payload: ProjectRequest,
     service: StorageService = Depends(get_database_service),
 ):
-    document_ids = await run_in_threadpool(service.list_documents, payload.project_id)
-
-    exam_questions = []
-    for doc_id in document_ids:
-        doc_exam_questions = await run_in_threadpool(service.list_exam_questions, doc_id)
-        exam_questions.extend(doc_exam_questions)
-
-    return ExamResponse(exam_questions)
+    exam_questions = await run_in_threadpool(service.list_exam_questions_for_project, payload.project_id)
+    return ExamResponse.model_construct(exam_questions)
 
 
 @app.post("/summary-with-images",
@@ -420,6 +449,17 @@ async def summary_with_images(
     return SummaryResponse(summary=project_overview.summary or "")
 
 
+@app.post("/generate-image-binary",
+          response_class=Response,
+          responses={200: {"content": {"image/jpeg": {}}}},
+          summary="Generate an image and return it as raw JPEG bytes")
+async def generate_image_binary(
+    payload: ImageRequest,
+    service: StudyBuddyService = Depends(get_studybuddy_service),
+):
+    image = await run_in_threadpool(service.generate_image_bytes, payload.prompt)
+    return Response(content=image, media_type="image/jpeg")
+
 
 @app.get(
     "/projects/{project_id}/chat",
@@ -431,21 +471,16 @@ async def chat_history(
     service: StorageService = Depends(get_database_service),
 ):
     rows = await run_in_threadpool(service.list_chat_messages, project_id)
-    messages = [_row_to_chat_message(row) for row in rows]
+    messages = _rows_to_chat_messages(rows)
     return ChatHistoryResponse(messages=messages)
 
 
-@app.post(
-    "/projects/{project_id}/chat",
-    response_model=ChatResponse,
-    summary="Append a chat message and generate the assistant reply",
-)
-async def chat(
+async def _prepare_chat_turn(
     project_id: int,
     payload: ChatRequest,
-    studybuddy_service: StudyBuddyService = Depends(get_studybuddy_service),
-    storage_service: StorageService = Depends(get_database_service),
-):
+    storage_service: StorageService,
+) -> Tuple[str, str, List[ChatMessage]]:
+    """Validate a chat request and load its document context and the stored chat history."""
     message = payload.message.strip()
     if not message:
         raise HTTPException(
@@ -453,21 +488,38 @@ async def chat(
             detail="Message must not be empty",
         )
 
-    project_overview = await run_in_threadpool(storage_service.get_project_overview, project_id)
+    project_overview, documents, history_rows = await run_in_threadpool(
+        storage_service.get_chat_preamble, project_id
+    )
     if project_overview is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Project {project_id} not found",
         )
 
-    # Get all documents for the project
-    documents = await run_in_threadpool(storage_service.list_documents_with_content, project_id)
-
     context = "\n\n".join(doc['content'] for doc in documents)
+    stored_messages = _rows_to_chat_messages(history_rows)
+    return message, context, stored_messages
+
+
+def _sse_event(data: Any, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
 
-        
-    history_rows = await run_in_threadpool(storage_service.list_chat_messages, project_id)
-    history_messages = _compress_chat_history([_row_to_chat_message(row) for row in history_rows])
+
+@app.post(
+    "/projects/{project_id}/chat",
+    response_model=ChatResponse,
+    summary="Append a chat message and generate the assistant reply",
+)
+async def chat(
+    project_id: int,
+    payload: ChatRequest,
+    studybuddy_service: StudyBuddyService = Depends(get_studybuddy_service),
+    storage_service: StorageService = Depends(get_database_service),
+):
+    message, context, stored_messages = await _prepare_chat_turn(project_id, payload, storage_service)
+    history_messages = _compress_chat_history(stored_messages)
 
     try:
         reply = await run_in_threadpool(
@@ -488,11 +540,47 @@ async def chat(
     await run_in_threadpool(storage_service.add_chat_message, project_id, "user", message)
     await run_in_threadpool(storage_service.add_chat_message, project_id, "assistant", reply)
 
-    updated_rows = await run_in_threadpool(storage_service.list_chat_messages, project_id)
-    messages = [_row_to_chat_message(row) for row in updated_rows]
+    # The stored thread plus the two new messages; no need to read it back
+    messages = stored_messages + [
+        ChatMessage(role="user", parts=[ChatPart(text=message)]),
+        ChatMessage(role="model", parts=[ChatPart(text=reply)]),
+    ]
     return ChatResponse(messages=messages)
 
 
+@app.post(
+    "/projects/{project_id}/chat/stream",
+    summary="Append a chat message and stream the assistant reply as server-sent events",
+)
+async def chat_stream(
+    project_id: int,
+    payload: ChatRequest,
+    studybuddy_service: StudyBuddyService = Depends(get_studybuddy_service),
+    storage_service: StorageService = Depends(get_database_service),
+):
+    message, context, stored_messages = await _prepare_chat_turn(project_id, payload, storage_service)
+    history_messages = _compress_chat_history(stored_messages)
+
+    def events() -> Iterator[str]:
+        # Runs in the threadpool; the turn is only persisted once the reply is complete.
+        chunks: List[str] = []
+        try:
+            for chunk in studybuddy_service.stream_chat_conversational(history_messages, context, message):
+                chunks.append(chunk)
+                yield _sse_event({"text": chunk})
+        except Exception:
+            logger.exception("Chat generation failed for project %s", project_id)
+            yield _sse_event({"detail": "Chat generation failed. Please try again."}, event="error")
+            return
+
+        reply = "".join(chunks).strip()
+        storage_service.add_chat_message(project_id, "user", message)
+        storage_service.add_chat_message(project_id, "assistant", reply)
+        yield _sse_event({"text": reply}, event="done")
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 @app.post("/add_document",
           response_model=AddDocumentResponse,
           summary="Add a document to a project")
@@ -539,4 +627,4 @@ __all__ = ["app"]
 if __name__ == "__main__":  # pragma: no cover - convenience entry point
     import uvicorn
 
-    uvicorn.run("backend.main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run("backend.main:app", host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
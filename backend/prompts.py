@@ -1,147 +1,160 @@
+from functools import lru_cache
 from textwrap import dedent
 
-def get_generate_flashcards_prompt(script_content: str) -> str:
-    return dedent(
-        f"""\
-        Generate a JSON array of 8-12 flashcards strictly based on the study material below.
-
-        CRITICAL OUTPUT REQUIREMENTS:
-        - Output ONLY a valid JSON array. Start with [ and end with ]
-        - Do NOT include any explanatory text before or after the JSON
-        - Do NOT include markdown code fences (```)
-        - Do NOT include phrases like "Here is" or "Please complete"
-        - Your entire response must be parseable as JSON
-
-        Each flashcard object must have:
-        - "question": A single sentence prompt (not yes/no question)
-        - "answer": A specific answer in 1-3 sentences
-
-        Quality guidelines:
-        - Use only facts explicitly present in the study material
-        - Mention the same terminology that appears in the material (protocol names, actors, variables, etc.)
-        - It is acceptable to produce fewer than 8 flashcards if the material is limited
-        - If the material does not contain enough information, return an empty JSON array []
-        - DO NOT invent examples or switch topics; submissions referencing unrelated domains will be rejected
-
-        <<<STUDY_MATERIAL>>>
-        {script_content.strip()}
-        <<<END_STUDY_MATERIAL>>>
-
-        JSON array:"""
-    )
-
-def get_generate_exam_prompt(script_content: str) -> str:
-    return dedent(
-        f"""\
-        Generate a JSON array of 8-12 multiple-choice exam questions based ONLY on the study material below.
-
-        CRITICAL OUTPUT REQUIREMENTS:
-        - Output ONLY a valid JSON array. Start with [ and end with ]
-        - Do NOT include any explanatory text before or after the JSON
-        - Do NOT include markdown code fences (```)
-        - Your entire response must be parseable as JSON
-        - Each question MUST have EXACTLY 4 options - no more, no less
-
-        Each question object must have:
-        - "question": A clear, direct question (one sentence)
-        - "options": An array of EXACTLY 4 answer choices (strings) - this is mandatory
-        - "correctAnswer": The exact text of one of the 4 options
-
-        Quality guidelines:
-        - Every question must cite terminology from the material (e.g. actor names, protocol steps, variables)
-        - Never reference topics that are absent from the material
-        - If there is not enough information for a question, do not create one
-        - If no valid questions can be created, return an empty JSON array []
-        - Distractors should be plausible variations of content actually discussed in the material
-
-        <<<STUDY_MATERIAL>>>
-        {script_content.strip()}
-        <<<END_STUDY_MATERIAL>>>
-
-        JSON array with each question having EXACTLY 4 options:"""
-    )
-
-def get_generate_summary_prompt(script_content: str) -> str:
-    return dedent(
-        f"""\
-        Create a study guide summary following this EXACT structure. Do not deviate from this format.
-
-        MANDATORY FORMAT - Copy this structure exactly:
-
-        ## Introduction
-        [Write 3-4 paragraphs here introducing the main topic and why it matters]
-
-        [IMAGE_PROMPT: Describe a vivid illustration scene here with concrete visual details]
-
-        ## Key Concepts
-        [Write 4-6 paragraphs here explaining the main ideas, processes, or mechanisms]
-
-        [IMAGE_PROMPT: Describe another illustration showing the concepts in action]
-
-        ## Summary
-        [Write 2-3 paragraphs here summarizing the key takeaways]
-
-        [IMAGE_PROMPT: Describe a final illustration that reinforces the main message]
-
-        CRITICAL RULES:
-        1. Start with "## Introduction" exactly as shown
-        2. After introduction paragraphs, add ONE line: [IMAGE_PROMPT: description]
-        3. Then add "## Key Concepts" section with paragraphs
-        4. After key concepts, add ONE line: [IMAGE_PROMPT: description]
-        5. Then add "## Summary" section with paragraphs
-        6. After summary, add ONE line: [IMAGE_PROMPT: description]
-        7. Do NOT use markdown image syntax like ![text](url)
-        8. Do NOT skip sections or change section names
-        9. IMAGE_PROMPT descriptions should be SHORT (20-40 words maximum)
-            
-        IMAGE PROMPT RULES - READ CAREFULLY:
-        - Create SYMBOLIC or CONCEPTUAL scenes, NOT technical diagrams
-        - NO charts, graphs, flowcharts, circuit diagrams, protocol diagrams, or network diagrams
-        - NO text, labels, arrows, or annotations in the image
-        - Think like stock photography: what OBJECTS, SCENES, or METAPHORS represent this concept?
-        - Use concrete objects: locks, keys, doors, hands, books, light, nature, architecture
-        - Focus on: lighting, mood, composition, realistic objects, symbolic representation
-            
-        GOOD examples (symbolic/conceptual):
-        [IMAGE_PROMPT: A glowing padlock surrounded by floating digital keys in a dark blue environment, symbolizing encryption and security]
-        [IMAGE_PROMPT: Two hands exchanging a sealed envelope with a wax stamp, representing secure message transfer, warm lighting]
-        [IMAGE_PROMPT: A fortress gate with intricate lock mechanisms, symbolizing authentication, dramatic sunset lighting]
-            
-        BAD examples (too technical - avoid these):
-        ❌ A flowchart showing client-server handshake protocol
-        ❌ A diagram with arrows connecting nodes
-        ❌ A cryptographic algorithm visualization with equations
-        ❌ A network topology diagram
-
-        <<<STUDY_MATERIAL>>>
-        {script_content.strip()}
-        <<<END_STUDY_MATERIAL>>>
-
-        Now write the study guide following the exact format above:
-
-        ## Introduction"""
-    )
-
-def get_chat_prompt(context: str, message: str, conversation: str) -> str:
-    return dedent(f"""
+# Flashcards and exam questions are generated with the pydantic schema enforced
+# by guided decoding, so their prompts describe content, not JSON syntax.
+#
+# The static parts of every template are dedented once at import time; the
+# builders below only splice the request-specific text in between them. The
+# whole instruction block precedes the study material, so it is a prefix
+# shared by every request for the same task (and its KV cache reused).
+
+_FLASHCARDS_PREFIX = dedent(
+    """\
+    Generate 8-12 flashcards strictly based on the study material below.
+
+    Each flashcard has:
+    - "question": A single sentence prompt (not yes/no question)
+    - "answer": A specific answer in 1-3 sentences
+
+    Quality guidelines:
+    - Use only facts explicitly present in the study material
+    - Mention the same terminology that appears in the material (protocol names, actors, variables, etc.)
+    - It is acceptable to produce fewer than 8 flashcards if the material is limited
+    - If the material does not contain enough information, return no flashcards
+    - DO NOT invent examples or switch topics; submissions referencing unrelated domains will be rejected
+
+    <<<STUDY_MATERIAL>>>
+    """
+)
+
+_EXAM_PREFIX = dedent(
+    """\
+    Generate 8-12 multiple-choice exam questions based ONLY on the study material below.
+
+    Each question has:
+    - "question": A clear, direct question (one sentence)
+    - "options": EXACTLY 4 answer choices - no more, no less
+    - "correctAnswer": The exact text of one of the 4 options
+
+    Quality guidelines:
+    - Every question must cite terminology from the material (e.g. actor names, protocol steps, variables)
+    - Never reference topics that are absent from the material
+    - If there is not enough information for a question, do not create one
+    - If no valid questions can be created, return no questions
+    - Distractors should be plausible variations of content actually discussed in the material
+
+    <<<STUDY_MATERIAL>>>
+    """
+)
+
+_SUMMARY_PREFIX = dedent(
+    """\
+    Create a study guide summary following this EXACT structure. Do not deviate from this format.
+
+    MANDATORY FORMAT - Copy this structure exactly:
+
+    ## Introduction
+    [Write 3-4 paragraphs here introducing the main topic and why it matters]
+
+    [IMAGE_PROMPT: Describe a vivid illustration scene here with concrete visual details]
+
+    ## Key Concepts
+    [Write 4-6 paragraphs here explaining the main ideas, processes, or mechanisms]
+
+    [IMAGE_PROMPT: Describe another illustration showing the concepts in action]
+
+    ## Summary
+    [Write 2-3 paragraphs here summarizing the key takeaways]
+
+    [IMAGE_PROMPT: Describe a final illustration that reinforces the main message]
+
+    CRITICAL RULES:
+    1. Start with "## Introduction" exactly as shown
+    2. After introduction paragraphs, add ONE line: [IMAGE_PROMPT: description]
+    3. Then add "## Key Concepts" section with paragraphs
+    4. After key concepts, add ONE line: [IMAGE_PROMPT: description]
+    5. Then add "## Summary" section with paragraphs
+    6. After summary, add ONE line: [IMAGE_PROMPT: description]
+    7. Do NOT use markdown image syntax like ![text](url)
+    8. Do NOT skip sections or change section names
+    9. IMAGE_PROMPT descriptions should be SHORT (20-40 words maximum)
+
+    IMAGE PROMPT RULES - READ CAREFULLY:
+    - Create SYMBOLIC or CONCEPTUAL scenes, NOT technical diagrams
+    - NO charts, graphs, flowcharts, circuit diagrams, protocol diagrams, or network diagrams
+    - NO text, labels, arrows, or annotations in the image
+    - Think like stock photography: what OBJECTS, SCENES, or METAPHORS represent this concept?
+    - Use concrete objects: locks, keys, doors, hands, books, light, nature, architecture
+    - Focus on: lighting, mood, composition, realistic objects, symbolic representation
+
+    GOOD examples (symbolic/conceptual):
+    [IMAGE_PROMPT: A glowing padlock surrounded by floating digital keys in a dark blue environment, symbolizing encryption and security]
+    [IMAGE_PROMPT: Two hands exchanging a sealed envelope with a wax stamp, representing secure message transfer, warm lighting]
+    [IMAGE_PROMPT: A fortress gate with intricate lock mechanisms, symbolizing authentication, dramatic sunset lighting]
+
+    BAD examples (too technical - avoid these):
+    ❌ A flowchart showing client-server handshake protocol
+    ❌ A diagram with arrows connecting nodes
+    ❌ A cryptographic algorithm visualization with equations
+    ❌ A network topology diagram
+
+    Now write the study guide for the material below following the exact format above,
+    starting with "## Introduction".
+
+    <<<STUDY_MATERIAL>>>
+    """
+)
+
+_MATERIAL_SUFFIX = "\n<<<END_STUDY_MATERIAL>>>"
+
+# The prompts are plain completions, so each ends with a short static cue that
+# the model continues from; the summary is primed with its first heading.
+_FLASHCARDS_SUFFIX = f"{_MATERIAL_SUFFIX}\n\nFlashcards as JSON:"
+_EXAM_SUFFIX = f"{_MATERIAL_SUFFIX}\n\nExam questions as JSON, each with EXACTLY 4 options:"
+_SUMMARY_SUFFIX = f"{_MATERIAL_SUFFIX}\n\n## Introduction"
+
+# Regenerating a project rebuilds the prompts of every unchanged document, so
+# the generation builders are memoized; str caches its hash, making a hit one
+# dict lookup. Kept small because each entry holds a full document.
+_PROMPT_CACHE_SIZE = 32
+
+# Identical on every chat turn, so it is always served from the prefix cache;
+# the regions after it are ordered from least to most frequently changing.
+_CHAT_PERSONA = dedent(
+    """\
     You are StudyBuddy — a playful, warm, witty study coach for beginners.
     Your job is to talk directly to the user, not to describe your reasoning.
-    Be friendly and concise (1–4 sentences). 
+    Be friendly and concise (1–4 sentences).
     Use facts only from <context>; if a fact isn't there, say you're not sure.
-    Small talk is fine, but stay casual and natural. 
+    Small talk is fine, but stay casual and natural.
     Do not create quizzes, lists, numbered options, or multiple answers.
     Always reply as yourself (StudyBuddy), not by describing what StudyBuddy would do.
     Output only the message you would say to the user — no tags, analysis, or explanations.
 
-    <context>
-    {context.strip() if context else ""}
-    </context>
+    """
+)
+
 
-    <conversation>
-    {conversation.strip() if conversation else ""}
-    </conversation>
+@lru_cache(maxsize=_PROMPT_CACHE_SIZE)
+def normalize_script(script_content: str) -> str:
+    """Return a document as it is embedded in the prompts; shared by all builders."""
+    return script_content.strip()
 
-    <user_message>
-    {message.strip()}
-    </user_message>
-    """).strip()
\ No newline at end of file
+@lru_cache(maxsize=_PROMPT_CACHE_SIZE)
+def get_generate_flashcards_prompt(script_content: str) -> str:
+    return f"{_FLASHCARDS_PREFIX}{normalize_script(script_content)}{_FLASHCARDS_SUFFIX}"
+
+@lru_cache(maxsize=_PROMPT_CACHE_SIZE)
+def get_generate_exam_prompt(script_content: str) -> str:
+    return f"{_EXAM_PREFIX}{normalize_script(script_content)}{_EXAM_SUFFIX}"
+
+@lru_cache(maxsize=_PROMPT_CACHE_SIZE)
+def get_generate_summary_prompt(script_content: str) -> str:
+    return f"{_SUMMARY_PREFIX}{normalize_script(script_content)}{_SUMMARY_SUFFIX}"
+
+def get_chat_prompt(context: str, message: str, conversation: str) -> str:
+    context_block = f"<context>\n{context.strip() if context else ''}\n</context>\n\n"
+    conversation_block = f"<conversation>\n{(conversation or '').strip() or '(none)'}\n</conversation>\n\n"
+    message_block = f"<user_message>\n{message.strip()}\n</user_message>"
+    return f"{_CHAT_PERSONA}{context_block}{conversation_block}{message_block}"
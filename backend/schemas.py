@@ -12,16 +12,23 @@ class Flashcard(BaseModel):
     question: str = Field(..., description="Front of the flashcard")
     answer: str = Field(..., description="Back of the flashcard")
 
+# The *List models are the guided-decoding schemas of the generation requests;
+# their length constraints are enforced token by token while the model decodes.
+MAX_GENERATED_ITEMS = 12
+
 class FlashcardList(BaseModel):
-    flashcards: List[Flashcard] = Field(..., description="List of flashcards")
+    flashcards: List[Flashcard] = Field(..., max_length=MAX_GENERATED_ITEMS, description="List of flashcards")
 
 class ExamQuestion(BaseModel):
     question: str
     options: List[str]
     correctAnswer: str
 
+class GeneratedExamQuestion(ExamQuestion):
+    options: List[str] = Field(..., min_length=4, max_length=4)
+
 class ExamQuestionList(BaseModel):
-    questions: List[ExamQuestion] = Field(..., description="List of exam questions")
+    questions: List[GeneratedExamQuestion] = Field(..., max_length=MAX_GENERATED_ITEMS, description="List of exam questions")
 
 
 class ScriptRequest(BaseModel):
@@ -2,12 +2,14 @@
 
 from __future__ import annotations
 
+import base64
+import hashlib
 import json
 import logging
 import re
 from functools import lru_cache
 from textwrap import dedent
-from typing import Any, List, Type
+from typing import Any, Iterator, List, Optional, Type
 
 from fastapi import HTTPException, status
 
@@ -34,6 +36,36 @@ from .schemas import (
 
 logger = logging.getLogger(__name__)
 
+# Meta-commentary the model sometimes appends after a "---" rule; everything
+# from the first occurrence onwards is dropped.
+_META_COMMENTARY_RE = re.compile(
+    r"---\s*(?:Human:|Please|Remember|Note:).*$",
+    re.IGNORECASE | re.MULTILINE | re.DOTALL,
+)
+_LEADING_LABEL_RE = re.compile(r"^[^\S\n]*(?:Assistant|StudyBuddy|Tutor)\s*:\s*", re.IGNORECASE)
+_TURN_MARKER_RE = re.compile(
+    r"\n[^\S\n]*(?:User|Human|Student|Teacher|System|Assistant)\s*:",
+    re.IGNORECASE,
+)
+# Stored chat roles mapped to the roles of the conversational API; others are dropped.
+_CONVERSATION_ROLES = {"user": "user", "assistant": "assistant", "model": "assistant"}
+
+
+@lru_cache(maxsize=4)
+def _generation_fingerprint(text_model_id: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (
+        text_model_id,
+        get_generate_flashcards_prompt(""),
+        get_generate_exam_prompt(""),
+        get_generate_summary_prompt(""),
+        json.dumps(FlashcardList.model_json_schema(), sort_keys=True),
+        json.dumps(ExamQuestionList.model_json_schema(), sort_keys=True),
+    ):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
 
 class StudyBuddyService:
     """High-level orchestrator for the generative AI services."""
@@ -43,6 +75,19 @@ class StudyBuddyService:
         self._text_client = VLLMTextGenerationClient(self.settings)
         self._image_client = LocalImageGenerationClient(self.settings)
 
+    def generation_fingerprint(self) -> str:
+        """Digest of everything besides the documents that shapes generated material.
+
+        Changing the text model, a prompt template or an output schema changes
+        it, so material generated under the old configuration is regenerated.
+        """
+        return _generation_fingerprint(self.settings.text_model_id)
+
+    def warmup(self) -> None:
+        """Run one minimal generation per model so the first real request starts hot."""
+        self._text_client.generate("warmup", max_new_tokens=1, temperature=0.0)
+        self._image_client.warmup()
+
     # ------------------------------------------------------------------
     # Flashcards
     # ------------------------------------------------------------------
@@ -54,6 +99,27 @@ class StudyBuddyService:
             max_new_tokens=1024,
             temperature=0.0,
         )
+        flashcards = self._parse_flashcards(structured)
+        if flashcards is None:
+            return [Flashcard(question="Error", answer="Could not generate flashcards.")]
+        return flashcards
+
+    def generate_flashcards_batch(self, script_contents: List[str]) -> List[Optional[List[Flashcard]]]:
+        """Generate flashcards for several documents in one engine batch, one list per document.
+
+        A document whose generation failed gets None instead of a list.
+        """
+        prompts = [get_generate_flashcards_prompt(content) for content in script_contents]
+        results = self._maybe_generate_structured_batch(
+            prompts,
+            FlashcardList,
+            max_new_tokens=1024,
+            temperature=0.0,
+        )
+        return [self._parse_flashcards(structured) for structured in results]
+
+    @staticmethod
+    def _parse_flashcards(structured: Any) -> Optional[List[Flashcard]]:
         # If structured came back as a model, dict, or JSON string — normalize it.
         if structured is not None:
             try:
@@ -68,7 +134,7 @@ class StudyBuddyService:
             except Exception as exc:
                 logger.warning("Failed to parse structured flashcards: %s", exc)
 
-        return [Flashcard(question="Error", answer="Could not generate flashcards.")]
+        return None
 
     # ------------------------------------------------------------------
     # Practice Exam
@@ -81,6 +147,27 @@ class StudyBuddyService:
             max_new_tokens=2048,
             temperature=0.0,
         )
+        exam_questions = self._parse_exam_questions(structured)
+        if exam_questions is None:
+            return [ExamQuestion(question="Error", options=["Could not generate exam questions."], correctAnswer="Could not generate exam questions.")]
+        return exam_questions
+
+    def generate_practice_exam_batch(self, script_contents: List[str]) -> List[Optional[List[ExamQuestion]]]:
+        """Generate exam questions for several documents in one engine batch, one list per document.
+
+        A document whose generation failed gets None instead of a list.
+        """
+        prompts = [get_generate_exam_prompt(content) for content in script_contents]
+        results = self._maybe_generate_structured_batch(
+            prompts,
+            ExamQuestionList,
+            max_new_tokens=2048,
+            temperature=0.0,
+        )
+        return [self._parse_exam_questions(structured) for structured in results]
+
+    @staticmethod
+    def _parse_exam_questions(structured: Any) -> Optional[List[ExamQuestion]]:
         # If structured came back as a model, dict, or JSON string — normalize it.
         if structured is not None:
             try:
@@ -95,7 +182,7 @@ class StudyBuddyService:
             except Exception as exc:
                 logger.warning("Failed to parse structured exam questions: %s", exc)
 
-        return [ExamQuestion(question="Error", options=["Could not generate exam questions."], correctAnswer="Could not generate exam questions.")]
+        return None
 
     # ------------------------------------------------------------------
     # Summary + images
@@ -120,6 +207,10 @@ class StudyBuddyService:
     # ------------------------------------------------------------------
     def generate_image(self, prompt: str) -> str:
         """Generate a single image from a text prompt and return as base64."""
+        return base64.b64encode(self.generate_image_bytes(prompt)).decode("ascii")
+
+    def generate_image_bytes(self, prompt: str) -> bytes:
+        """Generate a single image from a text prompt and return the JPEG bytes."""
         if not self.settings.enable_image_generation:
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
@@ -129,7 +220,7 @@ class StudyBuddyService:
         # Simplify and truncate prompt if too long
         # SDXL models work best with prompts under 77 tokens (~300 chars)
         if len(prompt) > 300:
-            logger.warning(f"Image prompt too long ({len(prompt)} chars), truncating")
+            logger.warning("Image prompt too long (%d chars), truncating", len(prompt))
             # Take first sentence or first 250 chars
             first_sentence = prompt.split('.')[0]
             if len(first_sentence) < 250:
@@ -138,7 +229,7 @@ class StudyBuddyService:
                 prompt = prompt[:250] + "..."
         
         try:
-            return self._image_client.generate(prompt)
+            return self._image_client.generate_bytes(prompt)
         except Exception as exc:
             logger.exception("Image generation failed for prompt '%s'", prompt)
             raise HTTPException(
@@ -152,21 +243,13 @@ class StudyBuddyService:
     def continue_chat(self, history: List[ChatMessage], system_instruction: str, message: str) -> str:
         conversation = self._render_history(history)
         prompt = get_chat_prompt(system_instruction, message, conversation)
-        print("Prompt for chat continuation:\n", prompt)
+        logger.debug("Chat continuation prompt (%d chars):\n%s", len(prompt), prompt)
         result = self._text_client.generate(prompt, max_new_tokens=512)
         response = result.text
         
         # Clean up any meta-commentary
-        cleanup_patterns = [
-            r"---\s*Human:.*$",
-            r"---\s*Please.*$",
-            r"---\s*Remember.*$",
-            r"---\s*Note:.*$",
-        ]
-        
-        for pattern in cleanup_patterns:
-            response = re.sub(pattern, "", response, flags=re.IGNORECASE | re.MULTILINE | re.DOTALL)
-        
+        response = _META_COMMENTARY_RE.sub("", response)
+
         response = self._strip_hallucinated_turns(response)
         return response.strip()
 
@@ -182,25 +265,35 @@ class StudyBuddyService:
         Returns:
             The assistant's response text
         """
-        # Convert ChatMessage format to dict format expected by generate_conversational
-        conversation_messages = []
-        for chat_msg in history:
-            # Extract text from parts
-            content = " ".join(part.text for part in chat_msg.parts)
-            # Map "model" role back to "assistant" for the conversational API
-            role = "assistant" if chat_msg.role == "model" else chat_msg.role
-            if role in {"user", "assistant"}:
-                conversation_messages.append({"role": role, "content": content})
-        
         result = self._text_client.generate_conversational(
             context=context,
-            conversation_messages=conversation_messages,
+            conversation_messages=self._to_conversation_messages(history),
             user_message=message,
             max_new_tokens=512,
             temperature=0.25,
         )
         return result.text
 
+    def stream_chat_conversational(self, history: List[ChatMessage], context: str, message: str) -> Iterator[str]:
+        """Like :meth:`continue_chat_conversational`, but yield the reply as it is generated."""
+        return self._text_client.generate_conversational_stream(
+            context=context,
+            conversation_messages=self._to_conversation_messages(history),
+            user_message=message,
+            max_new_tokens=512,
+            temperature=0.25,
+        )
+
+    @staticmethod
+    def _to_conversation_messages(history: List[ChatMessage]) -> List[dict]:
+        # Convert ChatMessage format to dict format expected by generate_conversational;
+        # "model" maps back to "assistant" for the conversational API
+        return [
+            {"role": _CONVERSATION_ROLES[chat_msg.role], "content": " ".join(part.text for part in chat_msg.parts)}
+            for chat_msg in history
+            if chat_msg.role in _CONVERSATION_ROLES
+        ]
+
 
 
     # ------------------------------------------------------------------
@@ -220,6 +313,28 @@ class StudyBuddyService:
             logger.warning("Structured generation failed: %s", exc)
             return None
 
+    def _maybe_generate_structured_batch(
+        self, prompts: List[str], response_model: Any, max_new_tokens: int, temperature: float = 0.7
+    ) -> List[Any]:
+        if not self._text_client.supports_structured_output:
+            return [None] * len(prompts)
+        try:
+            results = self._text_client.generate_structured_batch(
+                prompts=prompts,
+                response_model=response_model,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+            )
+        except Exception as exc:
+            logger.warning("Batched structured generation failed: %s", exc)
+            return [None] * len(prompts)
+        # Failed prompts come back as exceptions; only those documents fall back
+        for index, result in enumerate(results):
+            if isinstance(result, Exception):
+                logger.warning("Structured generation failed for prompt %d of %d: %s", index + 1, len(results), result)
+                results[index] = None
+        return results
+
     @staticmethod
     def _render_history(history: List[ChatMessage]) -> str:
         rendered_turns: List[str] = []
@@ -237,15 +352,10 @@ class StudyBuddyService:
             return text
 
         # Drop an initial assistant label if the model echoes the role.
-        leading_label = re.compile(r"^[^\S\n]*(?:Assistant|StudyBuddy|Tutor)\s*:\s*", re.IGNORECASE)
-        text = re.sub(leading_label, "", text, count=1)
+        text = _LEADING_LABEL_RE.sub("", text, count=1)
 
         # Cut off once the model starts inventing a new turn label.
-        turn_marker = re.compile(
-            r"\n[^\S\n]*(?:User|Human|Student|Teacher|System|Assistant)\s*:",
-            re.IGNORECASE,
-        )
-        match = turn_marker.search(text)
+        match = _TURN_MARKER_RE.search(text)
         if match:
             text = text[:match.start()].rstrip()
 
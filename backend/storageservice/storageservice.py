@@ -10,7 +10,7 @@ from ..schemas import (
 
 Row = sqlite3.Row
 
-SCHEMA_VERSION = 1
+SCHEMA_VERSION = 2
 
 
 DDL = """
@@ -169,16 +169,15 @@ LEFT JOIN doc_chunks c ON c.document_id = d.id
 GROUP BY d.id;
 """
 
+# Bytes of the database file read through a memory map instead of read() calls
+_MMAP_SIZE = 256 * 1024 * 1024
+
 class StorageService:
     def __init__(self, db_path: str):
         self.db_path = db_path
         self._local = threading.local()
         # Initialize the schema using a temporary connection
-        conn = sqlite3.connect(db_path)
-        conn.execute("PRAGMA foreign_keys = ON;")
-        conn.execute("PRAGMA journal_mode = WAL;")
-        conn.execute("PRAGMA synchronous = NORMAL;")
-        conn.row_factory = sqlite3.Row
+        conn = self._connect()
         self._ensure_schema_with_connection(conn)
         conn.close()
     
@@ -186,13 +185,21 @@ class StorageService:
     def connection(self) -> sqlite3.Connection:
         """Get a thread-local connection to the database."""
         if not hasattr(self._local, 'connection') or self._local.connection is None:
-            self._local.connection = sqlite3.connect(self.db_path)
-            self._local.connection.execute("PRAGMA foreign_keys = ON;")
-            self._local.connection.execute("PRAGMA journal_mode = WAL;")
-            self._local.connection.execute("PRAGMA synchronous = NORMAL;")
-            self._local.connection.row_factory = sqlite3.Row
+            self._local.connection = self._connect()
         return self._local.connection
 
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA foreign_keys = ON;")
+        # WAL lets readers proceed while another thread writes
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute("PRAGMA synchronous = NORMAL;")
+        # Keep sort/temp tables in RAM and map the database file
+        conn.execute("PRAGMA temp_store = MEMORY;")
+        conn.execute(f"PRAGMA mmap_size = {_MMAP_SIZE};")
+        conn.row_factory = sqlite3.Row
+        return conn
+
     # ---------- internal ----------
     def _ensure_schema_with_connection(self, conn: sqlite3.Connection) -> None:
         """Ensure schema exists using the provided connection."""
@@ -200,9 +207,14 @@ class StorageService:
         version = cur.fetchone()[0]
         if version < 1:
             conn.executescript(DDL)
-            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
-            conn.commit()
-        # Future migrations can go here (if version < 2: ...)
+            version = 1
+        if version < 2:
+            # Hash of the document contents the stored study material was generated from
+            conn.execute("ALTER TABLE projects ADD COLUMN content_hash TEXT;")
+            version = 2
+        conn.execute(f"PRAGMA user_version = {version};")
+        conn.commit()
+        # Future migrations can go here (if version < 3: ...)
 
     def close(self) -> None:
         """Close the thread-local connection if it exists."""
@@ -294,12 +306,37 @@ class StorageService:
         )
         self.connection.commit()
 
+    def get_project_content_hash(self, project_id: int) -> Optional[str]:
+        row = self._one("SELECT content_hash FROM projects WHERE id = ?", (project_id,))
+        return row["content_hash"] if row else None
+
+    def update_project_content_hash(self, project_id: int, content_hash: Optional[str]) -> None:
+        self.connection.execute(
+            "UPDATE projects SET content_hash = ? WHERE id = ?",
+            (content_hash, project_id)
+        )
+        self.connection.commit()
+
     def list_projects(self, user_id: int) -> List[Row]:
         return self._all(
             "SELECT * FROM projects WHERE user_id = ? ORDER BY name",
             (user_id,)
         )
 
+    def list_projects_with_counts(self, user_id: int) -> List[Row]:
+        """Projects of a user with a ``document_count`` column, in one query."""
+        return self._all(
+            """
+            SELECT p.*, COUNT(d.id) AS document_count
+            FROM projects p
+            LEFT JOIN documents d ON d.project_id = p.id
+            WHERE p.user_id = ?
+            GROUP BY p.id
+            ORDER BY p.name
+            """,
+            (user_id,)
+        )
+
     def get_project_overview(self, project_id: int) -> Optional[Project]:
         row = self._one(
             "SELECT name, summary FROM projects WHERE id = ?",
@@ -341,6 +378,15 @@ class StorageService:
     def get_document(self, document_id: int) -> Optional[Row]:
         return self._one("SELECT * FROM documents WHERE id = ?", (document_id,))
 
+    def get_documents_by_ids(self, document_ids: Sequence[int]) -> List[Row]:
+        if not document_ids:
+            return []
+        placeholders = ",".join("?" for _ in document_ids)
+        return self._all(
+            f"SELECT * FROM documents WHERE id IN ({placeholders}) ORDER BY created_at ASC, id ASC",
+            list(document_ids)
+        )
+
     def list_documents(self, project_id: int) -> List[Row]:
         rows = self._all(
             "SELECT * FROM documents WHERE project_id = ? ORDER BY created_at ASC",
@@ -358,7 +404,7 @@ class StorageService:
 
     def list_documents_with_content(self, project_id: int) -> List[Row]:
         return self._all(
-            "SELECT id, title, content, created_at, updated_at FROM documents WHERE project_id = ? ORDER BY created_at ASC",
+            "SELECT id, title, content, created_at, updated_at FROM documents WHERE project_id = ? ORDER BY created_at ASC, id ASC",
             (project_id,)
         )
 
@@ -443,9 +489,20 @@ class StorageService:
         self.connection.commit()
         return cur.lastrowid
 
+    def bulk_add_flashcards(self, flashcards: Sequence[Tuple[int, str, str]]) -> None:
+        """
+        flashcards: sequence of (document_id, front, back), inserted in one transaction.
+        The rows share created_at, so readers break ties by rowid to keep their order.
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO flashcards (document_id, front, back) VALUES (?, ?, ?)",
+                flashcards
+            )
+
     def list_flashcards(self, document_id: int) -> List[Row]:
         rows = self._all(
-            "SELECT * FROM flashcards WHERE document_id = ? ORDER BY created_at ASC",
+            "SELECT * FROM flashcards WHERE document_id = ? ORDER BY created_at ASC, rowid ASC",
             (document_id,)
         )
 
@@ -458,6 +515,20 @@ class StorageService:
 
         return flashcards
 
+    def list_flashcards_for_project(self, project_id: int) -> List[Flashcard]:
+        """Flashcards of all documents in a project, grouped in document creation order."""
+        rows = self._all(
+            """
+            SELECT f.front, f.back
+            FROM flashcards f
+            JOIN documents d ON d.id = f.document_id
+            WHERE d.project_id = ?
+            ORDER BY d.created_at ASC, d.id ASC, f.created_at ASC, f.rowid ASC
+            """,
+            (project_id,)
+        )
+        return [Flashcard(question=row["front"], answer=row["back"]) for row in rows]
+
     def delete_flashcard(self, flashcard_id: int) -> None:
         self.connection.execute("DELETE FROM flashcards WHERE id = ?", (flashcard_id,))
         self.connection.commit()
@@ -492,30 +563,58 @@ class StorageService:
         self.connection.commit()
         return cur.lastrowid
 
+    def bulk_add_exam_questions(
+        self, questions: Sequence[Tuple[int, str, str, str, str, str, str]]
+    ) -> None:
+        """
+        questions: sequence of (document_id, question, option_a, option_b, option_c, option_d, answer_letter),
+        inserted in one transaction (ordered by rowid on read, see bulk_add_flashcards)
+        """
+        with self.connection:
+            self.connection.executemany(
+                """
+                INSERT INTO exam_questions
+                (document_id, question, option_a, option_b, option_c, option_d, answer_letter)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                questions
+            )
+
     def list_exam_questions(self, document_id: int) -> List[Row]:
         rows = self._all(
-            "SELECT * FROM exam_questions WHERE document_id = ? ORDER BY created_at ASC",
+            "SELECT * FROM exam_questions WHERE document_id = ? ORDER BY created_at ASC, rowid ASC",
             (document_id,)
         )
 
-        exam_questions = []
-        for row in rows:
-            options = [
-                row["option_a"],
-                row["option_b"],
-                row["option_c"],
-                row["option_d"],
-            ]
-
-            exam_questions.append(
-                ExamQuestion(
-                    question=row["question"],
-                    options=options,
-                    correctAnswer=row["answer_letter"].upper()
-                )
-            )
+        return [self._to_exam_question(row) for row in rows]
 
-        return exam_questions
+    def list_exam_questions_for_project(self, project_id: int) -> List[ExamQuestion]:
+        """Exam questions of all documents in a project, grouped in document creation order."""
+        rows = self._all(
+            """
+            SELECT e.question, e.option_a, e.option_b, e.option_c, e.option_d, e.answer_letter
+            FROM exam_questions e
+            JOIN documents d ON d.id = e.document_id
+            WHERE d.project_id = ?
+            ORDER BY d.created_at ASC, d.id ASC, e.created_at ASC, e.rowid ASC
+            """,
+            (project_id,)
+        )
+        return [self._to_exam_question(row) for row in rows]
+
+    @staticmethod
+    def _to_exam_question(row: Row) -> ExamQuestion:
+        options = [
+            row["option_a"],
+            row["option_b"],
+            row["option_c"],
+            row["option_d"],
+        ]
+        return ExamQuestion(
+            question=row["question"],
+            options=options,
+            correctAnswer=row["answer_letter"].upper()
+        )
 
     def delete_exam_question(self, question_id: int) -> None:
         self.connection.execute("DELETE FROM exam_questions WHERE id = ?", (question_id,))
@@ -559,6 +658,17 @@ class StorageService:
             rows = self._all(sql, (chat["id"], limit))
             return list(reversed(rows))  # chronological
 
+    def get_chat_preamble(self, project_id: int) -> Tuple[Optional[Project], List[Row], List[Row]]:
+        """Project overview, documents with content and chat history needed to answer a chat turn.
+
+        Loaded together so a chat request needs a single threadpool hop; the
+        documents and history are empty when the project does not exist.
+        """
+        overview = self.get_project_overview(project_id)
+        if overview is None:
+            return None, [], []
+        return overview, self.list_documents_with_content(project_id), self.list_chat_messages(project_id)
+
     # ---------- dashboards ----------
     def project_overview(self, user_id: int) -> List[Row]:
         return self._all(
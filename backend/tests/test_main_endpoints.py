@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import json
 import sys
 import sqlite3
 from pathlib import Path
@@ -161,6 +162,7 @@ sys.modules["vllm.sampling_params"] = vllm_sampling_stub
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
 from backend.main import app
+from backend.schemas import ExamQuestion, Flashcard
 from backend.service import get_studybuddy_service
 from backend.storageservice.storageservice import StorageService, get_database_service
 
@@ -174,7 +176,12 @@ class StubService:
 
     def __init__(self) -> None:
         self.chat_response = "Hello from StudyBuddy!"
+        self.chat_stream_chunks = ["Hello", " from", " StudyBuddy!"]
         self.image_response = "YmFzZTY0LWltYWdlLWRhdGE="
+        self.image_bytes = b"\xff\xd8jpeg-bytes\xff\xd9"
+        self.summary_response = "## Introduction\nCells are small."
+        self.fingerprint = "generation-v1"
+        self.failed_documents: set[int] = set()
         self.calls: dict[str, tuple] = {}
         self.exceptions: dict[str, HTTPException] = {}
 
@@ -191,11 +198,46 @@ class StubService:
         self._maybe_raise("continue_chat")
         return self.chat_response
 
+    def stream_chat_conversational(self, history, context, message):
+        self._remember("stream_chat_conversational", history, context, message)
+        for chunk in self.chat_stream_chunks:
+            self._maybe_raise("stream_chat_conversational")
+            yield chunk
+
     def generate_image(self, prompt: str):  # pragma: no cover - exercised via API
         self._remember("generate_image", prompt)
         self._maybe_raise("generate_image")
         return self.image_response
 
+    def generate_image_bytes(self, prompt: str) -> bytes:
+        self._remember("generate_image_bytes", prompt)
+        self._maybe_raise("generate_image_bytes")
+        return self.image_bytes
+
+    def generation_fingerprint(self) -> str:
+        return self.fingerprint
+
+    def generate_flashcards_batch(self, script_contents):
+        self._remember("generate_flashcards_batch", script_contents)
+        self._maybe_raise("generate_flashcards_batch")
+        return [
+            None if index in self.failed_documents else [Flashcard(question=f"Card {index}", answer=f"Back {index}")]
+            for index in range(len(script_contents))
+        ]
+
+    def generate_practice_exam_batch(self, script_contents):
+        self._remember("generate_practice_exam_batch", script_contents)
+        self._maybe_raise("generate_practice_exam_batch")
+        return [
+            [ExamQuestion(question=f"Question {index}", options=["W", "X", "Y", "Z"], correctAnswer="Y")]
+            for index in range(len(script_contents))
+        ]
+
+    def generate_summary_with_images(self, script_content: str) -> str:
+        self._remember("generate_summary_with_images", script_content)
+        self._maybe_raise("generate_summary_with_images")
+        return self.summary_response
+
 
 @pytest.fixture
 def storage_service(tmp_path):
@@ -458,3 +500,182 @@ def test_chat_append_propagates_http_errors(client: TestClient) -> None:
 
     assert response.status_code == 418
     assert response.json() == {"detail": "Nope"}
+
+
+def _parse_sse(body: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+
+def test_chat_stream_yields_chunks_and_persists_reply(client: TestClient) -> None:
+    stub = get_stub(client)
+    service = get_storage(client)
+    project_info = _seed_project_with_content(service)
+    project_id = project_info["project_id"]
+    service.add_chat_message(project_id, "user", "Previous question")
+
+    response = client.post(f"/projects/{project_id}/chat/stream", json={"message": "Next?"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert _parse_sse(response.text) == [
+        ("message", {"text": "Hello"}),
+        ("message", {"text": " from"}),
+        ("message", {"text": " StudyBuddy!"}),
+        ("done", {"text": "Hello from StudyBuddy!"}),
+    ]
+
+    history, context, message = stub.calls["stream_chat_conversational"]
+    assert message == "Next?"
+    assert [m.parts[0].text for m in history] == ["Previous question"]
+    assert "Cells divide to reproduce" in context
+
+    stored_rows = service.list_chat_messages(project_id)
+    assert [(row["role"], row["content"]) for row in stored_rows][-2:] == [
+        ("user", "Next?"),
+        ("assistant", "Hello from StudyBuddy!"),
+    ]
+
+
+def test_chat_stream_reports_errors_without_persisting(client: TestClient) -> None:
+    stub = get_stub(client)
+    stub.exceptions["stream_chat_conversational"] = RuntimeError("engine died")
+    service = get_storage(client)
+    project_info = _seed_project_with_content(service)
+    project_id = project_info["project_id"]
+
+    response = client.post(f"/projects/{project_id}/chat/stream", json={"message": "Hello?"})
+
+    assert response.status_code == 200
+    assert _parse_sse(response.text) == [
+        ("error", {"detail": "Chat generation failed. Please try again."}),
+    ]
+    assert service.list_chat_messages(project_id) == []
+
+
+def test_generate_replaces_materials_and_caches_complete_runs(client: TestClient) -> None:
+    service = get_storage(client)
+    stub = get_stub(client)
+    project_id = _seed_project_with_content(service)["project_id"]
+
+    response = client.post("/generate", json={"project_id": project_id})
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "success"}
+    assert len(stub.calls["generate_flashcards_batch"][0]) == 2
+    assert client.post("/flashcards", json={"project_id": project_id}).json() == [
+        {"question": "Card 0", "answer": "Back 0"},
+        {"question": "Card 1", "answer": "Back 1"},
+    ]
+    assert client.post("/practice-exam", json={"project_id": project_id}).json() == [
+        {"question": "Question 0", "options": ["W", "X", "Y", "Z"], "correctAnswer": "C"},
+        {"question": "Question 1", "options": ["W", "X", "Y", "Z"], "correctAnswer": "C"},
+    ]
+    assert client.post("/summary-with-images", json={"project_id": project_id}).json() == {
+        "summary": stub.summary_response
+    }
+    assert service.get_project_content_hash(project_id) is not None
+
+    stub.calls.clear()
+    response = client.post("/generate", json={"project_id": project_id})
+
+    assert response.json() == {"status": "cached"}
+    assert stub.calls == {}
+
+
+def test_generate_reruns_when_documents_or_generation_setup_change(client: TestClient) -> None:
+    service = get_storage(client)
+    stub = get_stub(client)
+    project_id = _seed_project_with_content(service)["project_id"]
+    assert client.post("/generate", json={"project_id": project_id}).json() == {"status": "success"}
+    first_hash = service.get_project_content_hash(project_id)
+
+    service.create_document(project_id, "Meiosis", "Cells divide into gametes")
+    assert client.post("/generate", json={"project_id": project_id}).json() == {"status": "success"}
+    assert len(stub.calls["generate_flashcards_batch"][0]) == 3
+    second_hash = service.get_project_content_hash(project_id)
+    assert second_hash != first_hash
+
+    stub.fingerprint = "generation-v2"
+    stub.calls.clear()
+    assert client.post("/generate", json={"project_id": project_id}).json() == {"status": "success"}
+    assert "generate_flashcards_batch" in stub.calls
+    assert service.get_project_content_hash(project_id) not in (None, second_hash)
+
+
+def test_generate_does_not_cache_runs_with_failed_documents(client: TestClient) -> None:
+    service = get_storage(client)
+    stub = get_stub(client)
+    project_id = _seed_project_with_content(service)["project_id"]
+    stub.failed_documents = {1}
+
+    response = client.post("/generate", json={"project_id": project_id})
+
+    assert response.json() == {"status": "partial"}
+    assert client.post("/flashcards", json={"project_id": project_id}).json() == [
+        {"question": "Card 0", "answer": "Back 0"},
+    ]
+    assert len(client.post("/practice-exam", json={"project_id": project_id}).json()) == 2
+    assert service.get_project_content_hash(project_id) is None
+
+    stub.failed_documents = set()
+    assert client.post("/generate", json={"project_id": project_id}).json() == {"status": "success"}
+    assert len(client.post("/flashcards", json={"project_id": project_id}).json()) == 2
+
+
+def test_generate_keeps_materials_when_summary_fails(client: TestClient) -> None:
+    service = get_storage(client)
+    stub = get_stub(client)
+    user_id = service.create_user("frank")
+    project_id = service.create_project(user_id, "Biology", summary="Previous summary")
+    service.create_document(project_id, "Mitosis", "Cells divide")
+    stub.exceptions["generate_summary_with_images"] = HTTPException(status_code=500, detail="prompt too long")
+
+    response = client.post("/generate", json={"project_id": project_id})
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "partial"}
+    assert client.post("/summary-with-images", json={"project_id": project_id}).json() == {
+        "summary": "Previous summary"
+    }
+    assert len(client.post("/flashcards", json={"project_id": project_id}).json()) == 1
+    assert len(client.post("/practice-exam", json={"project_id": project_id}).json()) == 1
+    assert service.get_project_content_hash(project_id) is None
+
+
+def test_generate_clears_summary_when_documents_are_empty(client: TestClient) -> None:
+    service = get_storage(client)
+    stub = get_stub(client)
+    user_id = service.create_user("erin")
+    project_id = service.create_project(user_id, "Drafts", summary="Summary of deleted notes")
+    service.create_document(project_id, "Empty", "")
+
+    response = client.post("/generate", json={"project_id": project_id})
+
+    assert response.json() == {"status": "success"}
+    assert "generate_summary_with_images" not in stub.calls
+    assert client.post("/summary-with-images", json={"project_id": project_id}).json() == {"summary": ""}
+
+
+def test_generate_image_binary_returns_jpeg_bytes(client: TestClient) -> None:
+    stub = get_stub(client)
+
+    response = client.post("/generate-image-binary", json={"prompt": "A dividing cell"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.content == stub.image_bytes
+    assert stub.calls["generate_image_bytes"] == ("A dividing cell",)
+
+
+def test_generate_image_binary_propagates_http_errors(client: TestClient) -> None:
+    stub = get_stub(client)
+    stub.exceptions["generate_image_bytes"] = HTTPException(status_code=503, detail="disabled")
+
+    response = client.post("/generate-image-binary", json={"prompt": "A dividing cell"})
+
+    assert response.status_code == 503
+    assert response.json() == {"detail": "disabled"}
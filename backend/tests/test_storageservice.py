@@ -95,6 +95,19 @@ def test_create_project_initialises_chat_and_lists_projects(storage_service: Sto
     assert storage_service.get_or_create_chat(project_id) == chat_id
 
 
+def test_list_projects_with_counts_includes_document_count(storage_service: StorageService) -> None:
+    user_id = storage_service.create_user("hana")
+    biology = storage_service.create_project(user_id, "Biology")
+    storage_service.create_project(user_id, "Art")
+    storage_service.create_document(biology, "Cells", "Content")
+    storage_service.create_document(biology, "Genes", "Content")
+
+    rows = storage_service.list_projects_with_counts(user_id)
+
+    assert [(row["name"], row["document_count"]) for row in rows] == [("Art", 0), ("Biology", 2)]
+    assert storage_service.list_projects_with_counts(user_id + 1) == []
+
+
 def test_update_project_summary_and_fetch_overview(storage_service: StorageService) -> None:
     user_id, project_id = _create_user_and_project(storage_service, summary=None)
 
@@ -108,6 +121,38 @@ def test_update_project_summary_and_fetch_overview(storage_service: StorageServi
     assert overview_after.summary == "Updated summary"
 
 
+def test_project_content_hash_round_trip(storage_service: StorageService) -> None:
+    _, project_id = _create_user_and_project(storage_service, name="jane")
+
+    assert storage_service.get_project_content_hash(project_id) is None
+
+    storage_service.update_project_content_hash(project_id, "abc123")
+    assert storage_service.get_project_content_hash(project_id) == "abc123"
+
+    storage_service.update_project_content_hash(project_id, None)
+    assert storage_service.get_project_content_hash(project_id) is None
+    assert storage_service.get_project_content_hash(project_id + 1) is None
+
+
+def test_schema_migrates_version_one_databases(tmp_path) -> None:
+    db_path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE projects (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, name TEXT NOT NULL, summary TEXT)"
+    )
+    conn.execute("INSERT INTO projects (user_id, name) VALUES (1, 'Legacy')")
+    conn.execute("PRAGMA user_version = 1;")
+    conn.commit()
+    conn.close()
+
+    service = StorageService(str(db_path))
+    try:
+        assert service.get_project_content_hash(1) is None
+        assert service.connection.execute("PRAGMA user_version;").fetchone()[0] == 2
+    finally:
+        service.close()
+
+
 def test_get_project_overview_returns_none_when_missing(storage_service: StorageService) -> None:
     assert storage_service.get_project_overview(9999) is None
 
@@ -177,6 +222,18 @@ def test_list_documents_handles_empty_and_returns_creation_order(storage_service
     assert storage_service.list_documents(project_id) == [doc1, doc2]
 
 
+def test_get_documents_by_ids_returns_creation_order(storage_service: StorageService) -> None:
+    _, project_id = _create_user_and_project(storage_service, name="ivan")
+    first = storage_service.create_document(project_id, "First", "One")
+    second = storage_service.create_document(project_id, "Second", "Two")
+    storage_service.create_document(project_id, "Third", "Three")
+
+    rows = storage_service.get_documents_by_ids([second, first])
+
+    assert [(row["id"], row["content"]) for row in rows] == [(first, "One"), (second, "Two")]
+    assert storage_service.get_documents_by_ids([]) == []
+
+
 def test_chunk_operations(storage_service: StorageService) -> None:
     _, project_id = _create_user_and_project(storage_service, name="erin")
     doc_id = storage_service.create_document(project_id, "Chapter", "Content")
@@ -222,6 +279,73 @@ def test_flashcard_crud(storage_service: StorageService) -> None:
     assert storage_service.list_flashcards(doc_id) == []
 
 
+def test_list_flashcards_and_exam_questions_for_project(storage_service: StorageService) -> None:
+    _, project_id = _create_user_and_project(storage_service, name="fiona")
+    doc_a = storage_service.create_document(project_id, "A", "Content A")
+    doc_b = storage_service.create_document(project_id, "B", "Content B")
+
+    storage_service.add_flashcard(doc_b, "FrontB", "BackB")
+    storage_service.add_flashcard(doc_a, "FrontA1", "BackA1")
+    storage_service.add_flashcard(doc_a, "FrontA2", "BackA2")
+    storage_service.add_exam_question(doc_b, "QB", "A", "B", "C", "D", "A")
+    storage_service.add_exam_question(doc_a, "QA", "A", "B", "C", "D", "C")
+
+    assert storage_service.list_flashcards_for_project(project_id) == [
+        Flashcard(question="FrontA1", answer="BackA1"),
+        Flashcard(question="FrontA2", answer="BackA2"),
+        Flashcard(question="FrontB", answer="BackB"),
+    ]
+    assert storage_service.list_exam_questions_for_project(project_id) == [
+        ExamQuestion(question="QA", options=["A", "B", "C", "D"], correctAnswer="C"),
+        ExamQuestion(question="QB", options=["A", "B", "C", "D"], correctAnswer="A"),
+    ]
+    assert storage_service.list_flashcards_for_project(project_id + 1) == []
+    assert storage_service.list_exam_questions_for_project(project_id + 1) == []
+
+
+def test_bulk_add_flashcards_and_exam_questions(storage_service: StorageService) -> None:
+    _, project_id = _create_user_and_project(storage_service, name="gabe")
+    doc_id = storage_service.create_document(project_id, "Doc", "Content")
+
+    storage_service.bulk_add_flashcards([(doc_id, "Front1", "Back1"), (doc_id, "Front2", "Back2")])
+    storage_service.bulk_add_exam_questions([(doc_id, "Pick one", "A", "B", "C", "D", "B")])
+
+    assert storage_service.list_flashcards(doc_id) == [
+        Flashcard(question="Front1", answer="Back1"),
+        Flashcard(question="Front2", answer="Back2"),
+    ]
+    assert storage_service.list_exam_questions(doc_id) == [
+        ExamQuestion(question="Pick one", options=["A", "B", "C", "D"], correctAnswer="B"),
+    ]
+
+    with pytest.raises(sqlite3.IntegrityError):
+        storage_service.bulk_add_exam_questions(
+            [
+                (doc_id, "Valid", "A", "B", "C", "D", "A"),
+                (doc_id, "Invalid", "A", "B", "C", "D", "Z"),
+            ]
+        )
+    assert len(storage_service.list_exam_questions(doc_id)) == 1
+
+
+def test_bulk_added_rows_keep_insertion_order(storage_service: StorageService) -> None:
+    _, project_id = _create_user_and_project(storage_service, name="gail")
+    doc_id = storage_service.create_document(project_id, "Doc", "Content")
+    fronts = [f"Front{index}" for index in range(30, 0, -1)]
+
+    storage_service.bulk_add_flashcards([(doc_id, front, "Back") for front in fronts])
+    storage_service.bulk_add_exam_questions([(doc_id, front, "A", "B", "C", "D", "A") for front in fronts])
+    # Rows written in one transaction share their timestamp
+    storage_service.connection.execute("UPDATE flashcards SET created_at = '2024-01-01 00:00:00'")
+    storage_service.connection.execute("UPDATE exam_questions SET created_at = '2024-01-01 00:00:00'")
+    storage_service.connection.commit()
+
+    assert [card.question for card in storage_service.list_flashcards(doc_id)] == fronts
+    assert [card.question for card in storage_service.list_flashcards_for_project(project_id)] == fronts
+    assert [question.question for question in storage_service.list_exam_questions(doc_id)] == fronts
+    assert [question.question for question in storage_service.list_exam_questions_for_project(project_id)] == fronts
+
+
 def test_exam_question_crud_and_validation(storage_service: StorageService) -> None:
     _, project_id = _create_user_and_project(storage_service, name="gina")
     doc_id = storage_service.create_document(project_id, "Doc", "Content")
@@ -278,6 +402,19 @@ def test_chat_flow_and_limits(storage_service: StorageService) -> None:
     assert storage_service.get_or_create_chat(project_id) == chat_id
 
 
+def test_get_chat_preamble_loads_overview_documents_and_history(storage_service: StorageService) -> None:
+    _, project_id = _create_user_and_project(storage_service, name="kate", summary="Cells")
+    storage_service.create_document(project_id, "Intro", "Cells are small")
+    storage_service.add_chat_message(project_id, "user", "Hi")
+
+    overview, documents, history = storage_service.get_chat_preamble(project_id)
+
+    assert overview == Project(name="kate's project", summary="Cells")
+    assert [row["content"] for row in documents] == ["Cells are small"]
+    assert [(row["role"], row["content"]) for row in history] == [("user", "Hi")]
+    assert storage_service.get_chat_preamble(project_id + 1) == (None, [], [])
+
+
 def test_list_chat_messages_returns_empty_for_projects_without_history(storage_service: StorageService) -> None:
     _, project_id = _create_user_and_project(storage_service, name="isaac")
 
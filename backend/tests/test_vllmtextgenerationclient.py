@@ -0,0 +1,237 @@
+"""Tests for the chat prompt renderer in :mod:`backend.aiservices.vllmtextgenerationclient`."""
+
+from __future__ import annotations
+
+import re
+import sys
+import types
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+
+class _SamplingParams:
+    def __init__(self, **kwargs) -> None:
+        self.kwargs = kwargs
+
+
+class _GuidedDecodingParams:
+    def __init__(self, **kwargs) -> None:
+        self.kwargs = kwargs
+
+
+class _FakeLLM:
+    def __init__(self, *args, **kwargs) -> None:
+        pass
+
+
+# Importing the client loads the ``backend`` package and with it the image
+# client, so the GPU libraries are stubbed like in the other test modules.
+torch_stub = types.ModuleType("torch")
+torch_stub.float16 = object()
+torch_stub.float32 = object()
+torch_stub.cuda = SimpleNamespace(is_available=lambda: False)
+
+diffusers_stub = types.ModuleType("diffusers")
+diffusers_stub.AutoPipelineForText2Image = object
+
+vllm_stub = types.ModuleType("vllm")
+vllm_stub.LLM = _FakeLLM
+vllm_stub.SamplingParams = _SamplingParams
+
+vllm_sampling_stub = types.ModuleType("vllm.sampling_params")
+vllm_sampling_stub.GuidedDecodingParams = _GuidedDecodingParams
+
+sys.modules.setdefault("torch", torch_stub)
+sys.modules.setdefault("diffusers", diffusers_stub)
+sys.modules.setdefault("vllm", vllm_stub)
+sys.modules.setdefault("vllm.sampling_params", vllm_sampling_stub)
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from backend.aiservices.vllmtextgenerationclient import (
+    _CHAT_SYSTEM_POLICY,
+    VLLMTextGenerationClient,
+    _ChatPromptRenderer,
+    _EngineLoop,
+)
+
+
+class _LlamaStyleTokenizer:
+    """Tokenizer double with a Llama 3 style chat template.
+
+    ``encode`` maps every character to its code point, so tokenizing the
+    prompt piece by piece gives the same ids as tokenizing it whole.
+    """
+
+    def __init__(self) -> None:
+        self.template_calls = 0
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True) -> str:
+        self.template_calls += 1
+        rendered = "<|begin_of_text|>"
+        for message in messages:
+            rendered += (
+                f"<|start_header_id|>{message['role']}<|end_header_id|>\n\n"
+                f"{message['content'].strip()}<|eot_id|>"
+            )
+        if add_generation_prompt:
+            rendered += "<|start_header_id|>assistant<|end_header_id|>\n\n"
+        return rendered
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> list[int]:
+        return [ord(char) for char in text]
+
+
+class _WordTokenizer(_LlamaStyleTokenizer):
+    """Merges runs of non-whitespace, so token boundaries depend on the neighbours."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._vocab: dict[str, int] = {}
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> list[int]:
+        return [self._vocab.setdefault(token, len(self._vocab)) for token in re.findall(r"\S+|\s+", text)]
+
+
+class _NoSystemRoleTokenizer(_LlamaStyleTokenizer):
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True) -> str:
+        if any(message["role"] == "system" for message in messages):
+            raise ValueError("System role not supported")
+        return super().apply_chat_template(messages, tokenize=tokenize, add_generation_prompt=add_generation_prompt)
+
+
+_POLICY = "You are StudyBuddy. Use the context.\n\nContext:\n"
+
+
+def _conversation(*turns: str) -> list[dict[str, str]]:
+    messages = [{"role": "system", "content": f"{_POLICY}Mitochondria produce ATP."}]
+    for index, content in enumerate(turns):
+        messages.append({"role": "user" if index % 2 == 0 else "assistant", "content": content})
+    return messages
+
+
+def test_render_matches_apply_chat_template_without_calling_it() -> None:
+    tokenizer = _LlamaStyleTokenizer()
+    renderer = _ChatPromptRenderer(tokenizer, system_prefix=_POLICY)
+    messages = _conversation("Hi!", "Hello, what shall we study?", "What do mitochondria do?")
+    expected = tokenizer.apply_chat_template(messages)
+    tokenizer.template_calls = 0
+
+    assert renderer.render(messages) == expected
+    assert renderer.render(_conversation("Hi!")) == _LlamaStyleTokenizer().apply_chat_template(_conversation("Hi!"))
+    assert tokenizer.template_calls == 0
+
+
+def test_render_falls_back_for_untrimmed_contents() -> None:
+    tokenizer = _LlamaStyleTokenizer()
+    renderer = _ChatPromptRenderer(tokenizer)
+    messages = _conversation("  Hi!  ")
+    tokenizer.template_calls = 0
+
+    assert renderer.render(messages) == _LlamaStyleTokenizer().apply_chat_template(messages)
+    assert tokenizer.template_calls == 1
+    assert renderer.render_token_ids(messages) is None
+
+
+def test_render_falls_back_for_non_alternating_conversations() -> None:
+    tokenizer = _LlamaStyleTokenizer()
+    renderer = _ChatPromptRenderer(tokenizer)
+    reference = _LlamaStyleTokenizer()
+    two_user_turns = _conversation("Hi!") + [{"role": "user", "content": "Anyone there?"}]
+    ends_with_assistant = _conversation("Hi!", "Hello!")
+    without_system = _conversation("Hi!")[1:]
+    tokenizer.template_calls = 0
+
+    for messages in (two_user_turns, ends_with_assistant, without_system):
+        assert renderer.render(messages) == reference.apply_chat_template(messages)
+        assert renderer.render_token_ids(messages) is None
+    assert tokenizer.template_calls == 3
+
+
+def test_render_uses_template_when_pieces_cannot_be_extracted() -> None:
+    tokenizer = _NoSystemRoleTokenizer()
+    renderer = _ChatPromptRenderer(tokenizer)
+    messages = [{"role": "user", "content": "Hi!"}]
+
+    assert renderer.render(messages) == _LlamaStyleTokenizer().apply_chat_template(messages)
+    assert renderer.render_token_ids(_conversation("Hi!")) is None
+
+
+def test_render_token_ids_equal_whole_prompt_tokenization() -> None:
+    tokenizer = _LlamaStyleTokenizer()
+    renderer = _ChatPromptRenderer(tokenizer, system_prefix=_POLICY)
+    first_turn = _conversation("Hi!")
+    later_turn = _conversation("Hi!", "Hello, what shall we study?", "What do mitochondria do?")
+    assert renderer._system_prefix == _POLICY
+
+    for messages in (first_turn, later_turn):
+        expected = tokenizer.encode(tokenizer.apply_chat_template(messages))
+        assert renderer.render_token_ids(messages) == expected
+
+    # A system message that does not start with the policy is encoded whole
+    other_system = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hi!"}]
+    assert renderer.render_token_ids(other_system) == tokenizer.encode(tokenizer.apply_chat_template(other_system))
+
+
+def test_render_token_ids_disabled_when_tokenization_depends_on_neighbours() -> None:
+    tokenizer = _WordTokenizer()
+    renderer = _ChatPromptRenderer(tokenizer, system_prefix=_POLICY)
+    messages = _conversation("Hi!")
+
+    assert renderer.render_token_ids(messages) is None
+    assert renderer.render(messages) == _LlamaStyleTokenizer().apply_chat_template(messages)
+
+
+
+def _chat_client(tokenizer: _LlamaStyleTokenizer) -> VLLMTextGenerationClient:
+    client = VLLMTextGenerationClient.__new__(VLLMTextGenerationClient)
+    client._chat_renderer = _ChatPromptRenderer(tokenizer, system_prefix=_CHAT_SYSTEM_POLICY)
+    client._eot_id = 0
+    return client
+
+
+@pytest.mark.parametrize("context", ["Cells divide.\n", "\n  Cells divide.\n\n", "", None])
+def test_chat_request_uses_token_ids_for_untrimmed_or_empty_context(context) -> None:
+    tokenizer = _LlamaStyleTokenizer()
+    client = _chat_client(tokenizer)
+
+    prompt, _ = client._conversational_request(context, [], "Hi!", None, None)
+
+    assert isinstance(prompt, dict)
+    system = f"{_CHAT_SYSTEM_POLICY}{(context or '').strip()}"
+    messages = [{"role": "system", "content": system}, {"role": "user", "content": "Hi!"}]
+    assert prompt["prompt_token_ids"] == tokenizer.encode(tokenizer.apply_chat_template(messages))
+
+class _FailingEngine:
+    """Engine double whose first step and abort both fail, then recovers."""
+
+    def __init__(self) -> None:
+        self.requests: list[str] = []
+        self.failures = 1
+
+    def add_request(self, request_id, prompt, sampling_params) -> None:
+        self.requests.append(request_id)
+
+    def abort_request(self, request_ids) -> None:
+        if self.failures:
+            raise RuntimeError("abort failed")
+        self.requests = [request_id for request_id in self.requests if request_id not in request_ids]
+
+    def step(self):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("step failed")
+        finished, self.requests = self.requests, []
+        return [SimpleNamespace(request_id=request_id, finished=True) for request_id in finished]
+
+
+def test_engine_loop_survives_failed_step_and_abort() -> None:
+    engine = _FailingEngine()
+    loop = _EngineLoop(SimpleNamespace(llm_engine=engine))
+
+    with pytest.raises(RuntimeError, match="step failed"):
+        loop.submit("first", None).result(timeout=5)
+    assert loop.submit("second", None).result(timeout=5).finished
+    assert list(loop.stream("third", None))[-1].finished
@@ -1,6 +1,31 @@
 import re
 from fastapi import HTTPException, status
 
+# Patterns are compiled once at import; fix_markdown runs on every summary.
+_STOP_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE)
+    for pattern in (
+        r'---+\s*Human:',
+        r'---+\s*Revised',
+        r'---+\s*\*\*Revised',
+        r'Human:\s*',
+        r'Assistant:\s*',
+        r'Revised\s+Introduction',
+        r'Can you rephrase',
+    )
+]
+_META_COMMENTARY_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE)
+    for pattern in (
+        r'Please note.*?(?:\.|$)',
+        r'Remember.*?(?:\.|$)',
+        r'Note:.*?(?:\.|$)',
+        r'\*\*Note:.*?(?:\.|$)',
+    )
+]
+_MARKDOWN_IMAGE_RE = re.compile(r'!\[([^\]]*)\]\([^\)]+\)')
+_EXCESS_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
 def fix_markdown(markdown: str) -> str:
     """
     Fix common markdown issues in the provided markdown string.
@@ -16,18 +41,8 @@ def fix_markdown(markdown: str) -> str:
         markdown = "## Introduction\n" + markdown
         
     # Remove everything after common hallucination patterns
-    stop_patterns = [
-        r'---+\s*Human:',
-        r'---+\s*Revised',
-        r'---+\s*\*\*Revised',
-        r'Human:\s*',
-        r'Assistant:\s*',
-        r'Revised\s+Introduction',
-        r'Can you rephrase',
-    ]
-        
-    for pattern in stop_patterns:
-        match = re.search(pattern, markdown, re.IGNORECASE)
+    for pattern in _STOP_PATTERNS:
+        match = pattern.search(markdown)
         if match:
             markdown = markdown[:match.start()]
             break
@@ -46,19 +61,11 @@ def fix_markdown(markdown: str) -> str:
             markdown = markdown[:last_period + 1]
         
     # Remove meta-commentary
-    cleanup_patterns = [
-        r'Please note.*?(?:\.|$)',
-        r'Remember.*?(?:\.|$)',
-        r'Note:.*?(?:\.|$)',
-        r'\*\*Note:.*?(?:\.|$)',
-    ]
-        
-    for pattern in cleanup_patterns:
-        markdown = re.sub(pattern, "", markdown, flags=re.IGNORECASE)
+    for pattern in _META_COMMENTARY_PATTERNS:
+        markdown = pattern.sub("", markdown)
         
     # Clean up markdown image syntax that the model might hallucinate
     # Convert ![alt text](url) to a generic IMAGE_PROMPT if found
-    markdown_image_pattern = r'!\[([^\]]*)\]\([^\)]+\)'
     def replace_markdown_image(match):
         alt_text = match.group(1)
         # Try to extract a meaningful description from the alt text
@@ -68,7 +75,7 @@ def fix_markdown(markdown: str) -> str:
             # If alt text is empty or too short, create a generic prompt
             return "[IMAGE_PROMPT: An illustration related to the study material]"
         
-    markdown = re.sub(markdown_image_pattern, replace_markdown_image, markdown)
+    markdown = _MARKDOWN_IMAGE_RE.sub(replace_markdown_image, markdown)
     
     lines = markdown.split('\n')
     fixed_lines = []
@@ -104,7 +111,7 @@ def fix_markdown(markdown: str) -> str:
     
     markdown = '\n'.join(fixed_lines)
     # Clean up excessive whitespace (more than 2 blank lines)
-    markdown = re.sub(r'\n{3,}', '\n\n', markdown.strip())
+    markdown = _EXCESS_BLANK_LINES_RE.sub('\n\n', markdown.strip())
     return markdown
 
 def validate_exam_questions(questions):
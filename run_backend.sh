@@ -30,5 +30,6 @@ if [ ! -x "$VENV_PY" ]; then
 fi
 
 # Run the FastAPI app
+# uvloop/httptools ship with uvicorn[standard]; a single worker keeps one copy of the models on the GPU
 echo "Starting StudyBuddy backend on host ${HOST}, port ${PORT}..."
-"$VENV_PY" -m uvicorn backend.main:app --host "$HOST" --port "$PORT"
+"$VENV_PY" -m uvicorn backend.main:app --host "$HOST" --port "$PORT" --loop uvloop --http httptools